@@ -0,0 +1,64 @@
+import multiprocessing
+import random
+import sys
+import time
+
+from minimax import Minimax
+
+
+def random_positions(n, n_moves, seed=0):
+    """
+    Return `n` states reached by `n_moves` random moves from the empty
+    board, in the 0/1 format taken by `Minimax.get_move`, skipping games
+    that end on the way.
+    """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < n:
+        minimax = Minimax(model_path=None)
+        minimax.set_position([' '] * 42)
+        for _ in range(n_moves):
+            minimax.make_move(rng.choice(minimax.actions()))
+            if minimax.utility() is not None:
+                break
+        else:
+            positions.append([
+                ' ' if sq == ' ' else 0 if sq == 'R' else 1 for sq in minimax.board
+            ])
+    return positions
+
+
+def bench(processes, positions, depth):
+    """
+    Search every position to `depth` with a pool of `processes`
+    processes, or the sequential search if `processes` is None, and
+    return `(seconds, nodes)`. The pool is started before timing.
+    """
+    minimax = Minimax(max_depth=depth, model_path=None, processes=processes)
+    minimax.get_move(positions[0])
+
+    nodes = 0
+    start = time.perf_counter()
+    for state in positions:
+        minimax.get_move(state)
+        nodes += minimax.nodes
+    seconds = time.perf_counter() - start
+    minimax.close()
+    return seconds, nodes
+
+
+if __name__ == "__main__":
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    positions = random_positions(8, 6)
+
+    print(f"{multiprocessing.cpu_count()} CPUs, {len(positions)} positions, depth {depth}")
+    seconds, nodes = bench(None, positions, depth)
+    base = seconds
+    print(f"sequential: {seconds:.2f}s, {nodes / len(positions):,.0f} nodes/move, {nodes / seconds:,.0f} nodes/s")
+    # the speedup is against the sequential search, split tasks visit more nodes
+    for processes in (1, 2, 4, 8):
+        seconds, nodes = bench(processes, positions, depth)
+        print(
+            f"{processes} processes: {seconds:.2f}s, {nodes / len(positions):,.0f} nodes/move, "
+            f"{nodes / seconds:,.0f} nodes/s, {base / seconds:.2f}x"
+        )
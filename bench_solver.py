@@ -0,0 +1,85 @@
+import random
+import sys
+import time
+
+from solver import Solver, position_from_moves, winning_squares, playable, column_mask, WIDTH
+
+
+def read_test_set(path):
+    """
+    Read a test set in the format of Pascal Pons's Connect 4 benchmarks,
+    a line per position with its moves as column numbers from 1 and its
+    score, and return a list of `(moves, score)`.
+    """
+    tests = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                moves, score = line.split()
+                tests.append((moves, int(score)))
+    return tests
+
+
+def random_test_set(n, n_moves, seed=0):
+    """
+    Return `n` positions reached by `n_moves` random moves, where the
+    player to move cannot win at once, as `(moves, None)` pairs.
+    """
+    rng = random.Random(seed)
+    tests = []
+    while len(tests) < n:
+        moves = ''
+        position = (0, 0, 0)
+        for _ in range(n_moves):
+            current, mask, played = position
+            columns = [col for col in range(WIDTH) if playable(mask) & column_mask(col)]
+            moves += str(rng.choice(columns) + 1)
+            position = position_from_moves(moves)
+            if position is None:
+                break
+        if position is not None and not winning_squares(position[0], position[1]) & playable(position[1]):
+            tests.append((moves, None))
+    return tests
+
+
+def bench(tests, weak=False):
+    """
+    Solve every test position with a new Solver and print positions/sec,
+    mean nodes and mean time per solve, and any wrong score.
+    """
+    solver = Solver()
+    nodes = 0
+    wrong = 0
+    start = time.perf_counter()
+
+    for moves, expected in tests:
+        solver.tt.clear()
+        solver.nodes = 0
+        score = solver.solve(*position_from_moves(moves), weak=weak)
+        nodes += solver.nodes
+
+        if weak and expected is not None:
+            expected = max(-1, min(1, expected))
+        if expected is not None and score != expected:
+            wrong += 1
+            print(f"{moves}: solved {score}, expected {expected}")
+
+    seconds = time.perf_counter() - start
+    print(
+        f"{len(tests)} positions in {seconds:.2f}s: {len(tests) / seconds:.1f} positions/s, "
+        f"{nodes / len(tests):,.0f} nodes and {1000 * seconds / len(tests):.2f} ms per solve, "
+        f"{nodes / seconds:,.0f} nodes/s, {wrong} wrong"
+    )
+
+
+if __name__ == "__main__":
+    # python bench_solver.py [--weak] [TEST_SET ...]
+    weak = "--weak" in sys.argv
+    paths = [arg for arg in sys.argv[1:] if arg != "--weak"]
+
+    if not paths:
+        print("random positions after 24 moves")
+        bench(random_test_set(100, 24), weak)
+    for path in paths:
+        print(path)
+        bench(read_test_set(path), weak)
@@ -0,0 +1,257 @@
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from c4model import DenseKernel
+from minimax import Minimax
+from q_connect4 import Connect4
+from q_connect4_agent import QConnect4Agent
+from q_table import FILE_HEADER
+from train import train
+
+# Metrics named `..._per_sec` are better higher, every other metric
+# (seconds, bytes) is better lower.
+
+
+def best_time(function, repeat=3):
+    """
+    Return the least time in seconds `function` takes over `repeat` runs.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def random_games(n, seed):
+    """
+    Return the moves of `n` random games, as lists of actions.
+    """
+    rng = random.Random(seed)
+    games = []
+    for _ in range(n):
+        game = Connect4()
+        actions = []
+        while game.result is None:
+            action = rng.choice(game.available_actions(game.board))
+            game.move(action)
+            actions.append(action)
+        games.append(actions)
+    return games
+
+
+def trained_agent(n_games, seed):
+    random.seed(seed)
+    q_agent = QConnect4Agent(alpha=0.5, epsilon=0.5)
+    train(q_agent=q_agent, n=n_games)
+    return q_agent
+
+
+def bench_engine():
+    games = random_games(200, seed=0)
+    n_moves = sum(len(actions) for actions in games)
+
+    def play():
+        for actions in games:
+            game = Connect4()
+            for action in actions:
+                game.move(action)
+
+    # every position of the games, set up before timing
+    positions = []
+    for actions in games:
+        game = Connect4()
+        for action in actions:
+            game.move(action)
+            positions.append(copy.deepcopy(game))
+
+    def terminal():
+        for game in positions:
+            game.terminal()
+
+    return {
+        "move_per_sec": n_moves / best_time(play),
+        "terminal_per_sec": len(positions) / best_time(terminal),
+    }
+
+
+def bench_train():
+    n_games = 300
+
+    def run():
+        trained_agent(n_games, seed=0)
+
+    return {"train_games_per_sec": n_games / best_time(run)}
+
+
+def bench_agent():
+    q_agent = trained_agent(500, seed=0)
+    rng = random.Random(1)
+    states = []
+    for actions in random_games(200, seed=1):
+        game = Connect4()
+        for action in actions[:-1]:
+            game.move(action)
+            states.append((game.board[:], rng.randrange(7)))
+
+    def lookups():
+        for state, action in states:
+            q_agent.choose_action(state, epsilon=False)
+
+    def updates():
+        for state, action in states:
+            q_agent.update(state, action, state, 0)
+
+    return {
+        "agent_lookup_per_sec": len(states) / best_time(lookups),
+        "agent_update_per_sec": len(states) / best_time(updates),
+    }
+
+
+def minimax_positions():
+    positions = []
+    for actions in random_games(5, seed=2):
+        game = Connect4()
+        for action in actions[:8]:
+            game.move(action)
+        positions.append(game.board[:])
+    return positions
+
+
+def bench_minimax(max_depth=6):
+    positions = minimax_positions()
+
+    metrics = dict()
+    nodes = 0
+    seconds = 0
+    for depth in range(1, max_depth + 1):
+        # a fresh search every time, nothing carried over
+        searches = [Minimax(max_depth=depth, tt_mb=16, model_path=None) for state in positions]
+        start = time.perf_counter()
+        for minimax, state in zip(searches, positions):
+            minimax.get_move(state)
+            nodes += minimax.nodes
+        elapsed = time.perf_counter() - start
+        seconds += elapsed
+        metrics[f"minimax_depth_{depth}_sec"] = elapsed / len(positions)
+
+    metrics["minimax_nodes_per_sec"] = nodes / seconds
+    return metrics
+
+
+def bench_minimax_model(max_depth=4):
+    """
+    Time searches scoring leaves with a DenseKernel model of random
+    weights, the size of a small leaf evaluation model, with and without
+    `batch_leaves`, and count the boards the model scores.
+    """
+    positions = minimax_positions()
+    rng = np.random.default_rng(0)
+    kernel = DenseKernel(
+        [rng.normal(0, 0.1, (42, 64)), rng.normal(0, 0.1, (64, 1))],
+        [np.zeros(64), np.zeros(1)],
+        ["relu", "tanh"],
+    )
+
+    metrics = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = os.path.join(directory, "model.npz")
+        kernel.save(model_path)
+        for batch_leaves, name in ((False, "minimax_model"), (True, "minimax_model_batched")):
+            for depth in range(1, max_depth + 1):
+                searches = [
+                    Minimax(max_depth=depth, tt_mb=16, model_path=model_path, batch_leaves=batch_leaves)
+                    for state in positions
+                ]
+                start = time.perf_counter()
+                for minimax, state in zip(searches, positions):
+                    minimax.get_move(state)
+                metrics[f"{name}_depth_{depth}_sec"] = (time.perf_counter() - start) / len(positions)
+            # every board scored is cached once in `leaf_cache`
+            metrics[f"{name}_leaves_per_move"] = sum(len(minimax.leaf_cache) for minimax in searches) / len(positions)
+    return metrics
+
+
+def bench_memory():
+    q_agent = trained_agent(1000, seed=0)
+    q = q_agent.q
+    n = len(q)
+
+    index_bytes = sys.getsizeof(q.index) + sum(sys.getsizeof(key) + sys.getsizeof(r) for key, r in q.index.items())
+    return {
+        "qtable_bytes_per_entry": (index_bytes + q.values.nbytes) / n,
+        "saved_bytes_per_entry": (FILE_HEADER.size + n * (8 + q.values.itemsize * q.values.shape[1])) / n,
+    }
+
+
+BENCHMARKS = {
+    "engine": bench_engine,
+    "train": bench_train,
+    "agent": bench_agent,
+    "minimax": bench_minimax,
+    "minimax_model": bench_minimax_model,
+    "memory": bench_memory,
+}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print every metric of `results` next to `baseline` and return the
+    names of the metrics more than `tolerance` (a fraction) worse.
+    """
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline:
+            print(f"{name:32} {value:16,.4f}")
+            continue
+        old = baseline[name]
+        change = (value - old) / old if old else 0
+        worse = -change if name.endswith("_per_sec") else change
+        flag = ""
+        if worse > tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:32} {value:16,.4f} {old:16,.4f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the game, the agent and the search.")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run out of {', '.join(BENCHMARKS)}, all by default")
+    parser.add_argument("--save", metavar="JSON", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="JSON", help="compare the results to a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown allowed before a regression")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+
+    results = dict()
+    for name in args.names or BENCHMARKS:
+        results.update(BENCHMARKS[name]())
+
+    baseline = dict()
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if regressions:
+        sys.exit(f"{len(regressions)} regressions: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import pickle
+import sys
+
+import numpy as np
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+
+ACTIVATIONS = {
+    "identity": lambda x: x,
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "tanh": np.tanh,
+    "logistic": lambda x: 1 / (1 + np.exp(-x)),
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "softmax": softmax,
+}
+
+
+class DenseKernel():
+
+    def __init__(self, weights, biases, activations):
+        """
+        Initialize a stack of dense layers, layer `i` computing
+        `activations[i](x @ weights[i] + biases[i])`.
+        """
+        for activation in activations:
+            if activation not in ACTIVATIONS:
+                raise ValueError(f"unsupported activation {activation!r}")
+
+        self.weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.biases = [np.asarray(b, dtype=np.float32) for b in biases]
+        self.activations = list(activations)
+
+    def predict(self, x):
+        """
+        Return the output of the layers for every row of the matrix `x`,
+        as a matrix with one row per input row.
+        """
+        x = np.asarray(x, dtype=np.float32)
+        for w, b, activation in zip(self.weights, self.biases, self.activations):
+            x = ACTIVATIONS[activation](x @ w + b)
+        return x
+
+    def save(self, path):
+        """
+        Write the layers to `path` as a NumPy `.npz` file.
+        """
+        arrays = {"activations": np.array(self.activations)}
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            arrays[f"w{i}"] = w
+            arrays[f"b{i}"] = b
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read layers written by `DenseKernel.save`.
+        """
+        with np.load(path) as arrays:
+            activations = arrays["activations"].tolist()
+            weights = [arrays[f"w{i}"] for i in range(len(activations))]
+            biases = [arrays[f"b{i}"] for i in range(len(activations))]
+        return cls(weights, biases, activations)
+
+
+def export_model(model):
+    """
+    Return a DenseKernel computing the same predictions as `model`:
+    a scikit-learn MLP or linear model, or a Keras model of dense
+    layers. Raise ValueError for any other kind of model.
+    """
+
+    # scikit-learn MLPRegressor and MLPClassifier
+    if hasattr(model, "coefs_"):
+        n_hidden = len(model.coefs_) - 1
+        activations = [model.activation] * n_hidden + [model.out_activation_]
+        return DenseKernel(model.coefs_, model.intercepts_, activations)
+
+    # scikit-learn linear models
+    if hasattr(model, "coef_"):
+        coef = np.atleast_2d(model.coef_)
+        return DenseKernel([coef.T], [np.atleast_1d(model.intercept_)], ["identity"])
+
+    # Keras models, where only dense layers carry weights
+    if hasattr(model, "layers"):
+        weights, biases, activations = [], [], []
+        for layer in model.layers:
+            layer_weights = layer.get_weights()
+            if not layer_weights:
+                continue
+            if type(layer).__name__ != "Dense":
+                raise ValueError(f"unsupported layer {type(layer).__name__}")
+            w, b = layer_weights
+            weights.append(w)
+            biases.append(b)
+            activations.append(layer.activation.__name__)
+        return DenseKernel(weights, biases, activations)
+
+    raise ValueError(f"unsupported model {type(model).__name__}")
+
+
+def load_model(path):
+    """
+    Load the leaf evaluation model at `path`. A `.npz` file written by
+    `DenseKernel.save` is loaded as it is. Anything else is unpickled
+    and, when `export_model` supports it, turned into a DenseKernel.
+    """
+    if path.endswith(".npz"):
+        return DenseKernel.load(path)
+
+    model = pickle.load(open(path, 'rb'))
+    try:
+        return export_model(model)
+    except ValueError:
+        return model
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python c4model.py MODEL.sav MODEL.npz")
+
+    export_model(pickle.load(open(sys.argv[1], 'rb'))).save(sys.argv[2])
@@ -1,57 +1,202 @@
+import os
 import pickle
 import multiprocessing
 import random
+import sys
+import time
 
+from metrics import JsonLines, rss_bytes
+from q_log import QLog, compact, load_checkpoint
 from train import train
 from play import play
-from q_connect4_agent import QConnect4Agent
+from q_connect4_agent import QConnect4Agent, migrate_q
+from q_table import MAX_LOAD, SharedQTable
 
-def worker(q_agent):
-    updated_q = train(q_agent=q_agent, n=1000)
-    q_agent.q.update(updated_q)
-    # print("worker: q size: ",len(q_agent.q))
-    # shared_q = queue.get()
+# self-play games every process trains per round, and rounds per run
+GAMES_PER_ROUND = 1000
+ROUNDS = 2
 
-    # trained_agent = train(n=10, alpha=alpha, epsilon=epsilon)
-    # shared_q.update(trained_agent.q)
+# A game adds at most one state per move to the table, and self-play
+# adds about 16 new states per game early on, fewer later.
+NEW_STATES_PER_GAME = 24
 
-    # print(f"Length of data: {len(shared_q)}")
+# the agent of a pool process, sent once by `init_worker`
+worker_agent = None
+# the Barrier of all pool processes that makes each take one task a round
+worker_barrier = None
 
-    # queue.put(shared_q)
-    return(q_agent.q)
 
+def init_worker(q_agent, barrier=None):
+    global worker_agent, worker_barrier
+    worker_agent = q_agent
+    worker_barrier = barrier
+    # forked processes start with the parent's random state
+    random.seed()
 
-def main():
+
+def train_worker():
+    """
+    Train the agent of this process and return the metrics of the
+    worker: the last report of `train` with the process id and RSS.
+    """
+    reports = []
+    train(q_agent=worker_agent, n=GAMES_PER_ROUND, metrics=reports.append, report_every=GAMES_PER_ROUND)
+    return dict(reports[-1], event="worker", pid=os.getpid(), rss_bytes=rss_bytes())
+
+
+def worker(merged):
+    """
+    Apply the rows `merged` by the parent in the last round, train
+    the agent of this process and return only what that changed,
+    pickled, with the metrics of the worker.
+
+    The pool is free to hand one process two tasks and another none,
+    which would then miss `merged` or apply it twice, so every task
+    first waits for all processes to hold one.
+    """
+    worker_barrier.wait()
+    if merged is not None:
+        worker_agent.q.set_rows(*merged)
+
+    worker_agent.q.start_delta()
+    stats = train_worker()
+
+    # pickled here rather than by the pool so it can be timed
+    start = time.perf_counter()
+    delta = pickle.dumps(worker_agent.q.take_delta(), protocol=pickle.HIGHEST_PROTOCOL)
+    stats["pickle_seconds"] = time.perf_counter() - start
+    stats["delta_bytes"] = len(delta)
+    return delta, stats
+
+
+def shared_worker(_):
+    """
+    Train the agent of this process on the SharedQTable all processes
+    update and return the metrics of the worker.
+    """
+    return train_worker()
+
+
+def main(shared=False, metrics=None, capacity=None):
+    """
+    Train an agent on every cpu and play against it. If `shared` is true,
+    all processes train one SharedQTable in place instead of each one
+    training its own copy and merging the changes after every round.
+
+    The SharedQTable cannot grow, so it gets `capacity` slots, by
+    default enough for `NEW_STATES_PER_GAME` new states in every game
+    planned at a load of at most `MAX_LOAD`. A warning is printed when
+    the planned games may take the load past `MAX_LOAD`, up front or
+    after a round.
+
+    The merged changes of every round are appended to `q_agent_q.c4log`,
+    which is folded into the snapshot `q_agent_q.c4q` once it grows to
+    half the size of the snapshot, and at the end. The SharedQTable
+    keeps no record of what changed, so with `shared` the whole table
+    is written to the snapshot after every round instead. Training
+    starts from the snapshot and the log if there are any.
+
+    If given, `metrics` is called with a dict of metrics for every
+    worker after every round, and for the round itself: its time split
+    into training, unpickling and merging, the throughput of all
+    workers together, the size of the Q-table and the RSS.
+    """
     alpha = 0.5
     epsilon = 0.5
 
     q_agent = QConnect4Agent(alpha=alpha, epsilon=epsilon)
-    try:
-        q_agent.q = pickle.load(open('q_agent_dict.pkl', 'rb'))
-        print("pkl loaded")
-    except:
-        print("pkl not loaded")
-        pass
+    if os.path.exists('q_agent_q.c4q') or os.path.exists('q_agent_q.c4log'):
+        q_agent.q = load_checkpoint('q_agent_q.c4q', 'q_agent_q.c4log')
+        print("q table loaded")
+    else:
+        try:
+            q_agent.q = migrate_q(pickle.load(open('q_agent_dict.pkl', 'rb')))
+            print("pkl loaded")
+        except:
+            print("pkl not loaded")
+            pass
+
     n_cpus = multiprocessing.cpu_count()
-    pool = multiprocessing.Pool(n_cpus)
 
-    q = dict()
-    for _ in range(2):
+    if shared:
+        planned = len(q_agent.q) + ROUNDS * n_cpus * GAMES_PER_ROUND * NEW_STATES_PER_GAME
+        if capacity is None:
+            capacity = int(planned / MAX_LOAD)
+        elif planned > MAX_LOAD * capacity:
+            print(f"warning: up to {planned} states planned for a capacity of {capacity}")
+        q_agent.q = SharedQTable.from_table(q_agent.q, capacity=capacity)
+
+    log = QLog('q_agent_q.c4log')
+
+    barrier = multiprocessing.Barrier(n_cpus)
+    pool = multiprocessing.Pool(n_cpus, initializer=init_worker, initargs=(q_agent, barrier))
+
+    merged = None
+    for round_number in range(ROUNDS):
         print("len q=", len(q_agent.q))
-        qs = [q_agent] * n_cpus
-        results = pool.map(worker, qs)
-        for i,r in enumerate(results):
-            # print(i, "=", len(r))
-            q_agent.q.update(r)
+        start = time.perf_counter()
+        unpickle_seconds = merge_seconds = 0
+        if shared:
+            workers = pool.map(shared_worker, range(n_cpus))
+            map_seconds = time.perf_counter() - start
+            if q_agent.q.load_factor() > MAX_LOAD:
+                print(f"warning: shared table {q_agent.q.load_factor():.0%} full, raise --capacity")
+            # no worker is updating the table between rounds
+            compact(q_agent.q, 'q_agent_q.c4q', log)
+        else:
+            results = pool.map(worker, [merged] * n_cpus, chunksize=1)
+            map_seconds = time.perf_counter() - start
+
+            deltas = [pickle.loads(delta) for delta, stats in results]
+            unpickle_seconds = time.perf_counter() - start - map_seconds
+            merged = q_agent.q.merge_deltas(deltas)
+            merge_seconds = time.perf_counter() - start - map_seconds - unpickle_seconds
+            workers = [stats for delta, stats in results]
+
+            log.append(*merged)
+            snapshot_size = os.path.getsize('q_agent_q.c4q') if os.path.exists('q_agent_q.c4q') else 0
+            if log.size() > snapshot_size / 2:
+                compact(q_agent.q, 'q_agent_q.c4q', log)
+
+        if metrics is not None:
+            seconds = time.perf_counter() - start
+            for stats in workers:
+                metrics(dict(stats, round=round_number))
+            metrics({
+                "event": "round",
+                "round": round_number,
+                "seconds": seconds,
+                "train_seconds": map_seconds,
+                "unpickle_seconds": unpickle_seconds,
+                "merge_seconds": merge_seconds,
+                "games_per_sec": sum(stats["games"] for stats in workers) / seconds,
+                "moves_per_sec": sum(stats["moves"] for stats in workers) / seconds,
+                "q_size": len(q_agent.q),
+                "rss_bytes": rss_bytes(),
+            })
 
     pool.close()
     print("len q=", len(q_agent.q))
     print("Ready To Play")
 
-    pickle.dump(q_agent.q, open('q_agent_dict.pkl', 'wb'))
+    compact(q_agent.q, 'q_agent_q.c4q', log)
+    log.close()
 
     play(q_agent=q_agent, human=random.randint(0, 1), helper=True)
 
+    if shared:
+        q_agent.q.close()
+        q_agent.q.unlink()
+
 if __name__ == "__main__":
-    main()
+    # python main_threading.py [--shared [--capacity N]] [--metrics [FILE]]
+    metrics = None
+    if "--metrics" in sys.argv:
+        i = sys.argv.index("--metrics")
+        path = sys.argv[i + 1] if i + 1 < len(sys.argv) and not sys.argv[i + 1].startswith("--") else None
+        metrics = JsonLines(path)
+    capacity = None
+    if "--capacity" in sys.argv:
+        capacity = int(sys.argv[sys.argv.index("--capacity") + 1])
+    main(shared="--shared" in sys.argv, metrics=metrics, capacity=capacity)
 
@@ -0,0 +1,38 @@
+import json
+import os
+import resource
+import sys
+import time
+
+
+def rss_bytes():
+    """
+    Return the resident memory of this process in bytes, or its peak
+    resident memory where the current one cannot be read.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class JsonLines():
+
+    def __init__(self, path=None):
+        """
+        Initialize a metrics callback writing every record it is called
+        with as one line of JSON, with the time it was written, to the
+        file at `path`, appended to, or to standard error.
+        """
+        self.file = sys.stderr if path is None else open(path, "a", buffering=1)
+
+    def __call__(self, record):
+        self.file.write(json.dumps(dict(record, time=time.time())) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stderr:
+            self.file.close()
@@ -1,11 +1,150 @@
-import pickle
-import pandas as pd
+import multiprocessing
+import random
+import time
+from array import array
+
+import numpy as np
+
+from c4model import load_model
+from q_connect4 import HEIGHT, is_win_through
+
+# columns closest to the center take part in the most lines
+CENTER_FIRST = [3, 2, 4, 1, 5, 0, 6]
+
+# a random 64 bit number for every chip on every square, so that the
+# hash of a board is the xor of the numbers of the chips on it
+ZOBRIST_RANDOM = random.Random(4)
+ZOBRIST = [{'R': ZOBRIST_RANDOM.getrandbits(64), 'B': ZOBRIST_RANDOM.getrandbits(64)} for sq in range(42)]
+
+# kinds of value kept in a TranspositionTable
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# the model input of a square by the byte of its 'R'/'B'/' ' chip
+CHIP_INPUTS = np.zeros(256, dtype=np.float32)
+CHIP_INPUTS[ord('R')] = 1
+CHIP_INPUTS[ord('B')] = -1
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside a search once its time budget is used up.
+    """
+
+
+# the Minimax of a pool process, built once by `init_search_worker`
+search_worker = None
+
+
+def init_search_worker(options):
+    global search_worker
+    search_worker = Minimax(**options)
+
+
+def search_subtree(task):
+    """
+    Search one task of a parallel `Minimax.get_move` in a pool process
+    and return `(value, nodes)`, with value None if it ran out of time.
+    """
+    board, action, depth, deadline = task
+    search_worker.nodes = 0
+    try:
+        value = search_worker.search_subtree(board, action, depth, deadline)
+    except SearchTimeout:
+        value = None
+    return value, search_worker.nodes
+
+
+def zobrist_hash(board):
+    h = 0
+    for sq, chip in enumerate(board):
+        if chip != ' ':
+            h ^= ZOBRIST[sq][chip]
+    return h
+
+
+class TranspositionTable():
+
+    # bytes of one entry: key, value, depth, kind of value, best move
+    ENTRY_SIZE = 8 + 8 + 1 + 1 + 1
+
+    def __init__(self, capacity_mb=16):
+        """
+        Initialize a table of searched positions taking about `capacity_mb`
+        megabytes. Positions are found by their Zobrist hash.
+
+        Every hash picks a bucket of two entries: the first keeps
+        whichever position was searched deepest, the second always
+        takes the latest position that did not make it into the first.
+        """
+        n_buckets = max(1, capacity_mb * 2 ** 20 // (2 * self.ENTRY_SIZE))
+        self.mask = (1 << (n_buckets.bit_length() - 1)) - 1
+        n_entries = 2 * (self.mask + 1)
+
+        self.keys = array('Q', bytes(8 * n_entries))
+        self.values = array('d', bytes(8 * n_entries))
+        self.depths = array('b', [-1]) * n_entries
+        self.kinds = array('b', bytes(n_entries))
+        self.moves = array('b', bytes(n_entries))
+
+    def probe(self, h):
+        """
+        Return `(value, depth, kind, move)` stored for the position
+        with hash `h`, or None if it is not in the table.
+        """
+        entry = 2 * (h & self.mask)
+        if self.keys[entry] != h or self.depths[entry] < 0:
+            entry += 1
+            if self.keys[entry] != h or self.depths[entry] < 0:
+                return None
+        return self.values[entry], self.depths[entry], self.kinds[entry], self.moves[entry]
+
+    def store(self, h, value, depth, kind, move):
+        """
+        Store `value` of the position with hash `h`, searched `depth`
+        plies deep, where `kind` tells if it is an EXACT value or a
+        LOWER or UPPER bound and `move` is the best move found.
+        """
+        entry = 2 * (h & self.mask)
+        if depth < self.depths[entry] and self.keys[entry] != h:
+            entry += 1
+        self.keys[entry] = h
+        self.values[entry] = value
+        self.depths[entry] = depth
+        self.kinds[entry] = kind
+        self.moves[entry] = -1 if move is None else move
+
+    def clear(self):
+        n_entries = len(self.keys)
+        self.depths = array('b', [-1]) * n_entries
+
 
 class Minimax():
 
-    def __init__(self, max_depth=4):
+    def __init__(self, max_depth=4, tt_mb=16, batch_leaves=True,
+                 model_path="../connect4-1/c4model.sav", processes=None, book=None):
 
         self.max_depth = max_depth
+        self.search_depth = max_depth
+        self.depth_reached = None
+        self.deadline = None
+        self.nodes = 0
+        self.tt = TranspositionTable(tt_mb)
+
+        # killer moves per depth and history scores per player for move ordering
+        self.killers = [[] for _ in range(max_depth + 2)]
+        self.history = {'R': [0] * 7, 'B': [0] * 7}
+
+        # Model scores of leaves by hash. With `batch_leaves`, a node just
+        # above the leaves that does not cut off after its first child
+        # scores all the others in one call to the model, see
+        # `score_children`, rather than one call per leaf. Children pruned
+        # afterwards are scored for nothing. With a DenseKernel model
+        # `benchmark.py minimax_model` finds it a little faster, and a
+        # model that is slower to call gains more.
+        self.batch_leaves = batch_leaves
+        self.leaf_cache = dict()
 
         self.heuristic = [
             [0], [0], [0], [0], [0], [0], [0],
@@ -16,9 +155,61 @@ class Minimax():
             [0], [1, -1], [3, -3], [4, -4], [3, -3], [1, -1], [0]
         ]
 
-        self.model = pickle.load(open("../connect4-1/c4model.sav", 'rb'))
-
-    def get_move(self, state):
+        # what a chip of each player on each square adds to the heuristic score
+        self.square_scores = {
+            'R': [sum(value for value in values if value > 0) for values in self.heuristic],
+            'B': [sum(value for value in values if value < 0) for values in self.heuristic],
+        }
+
+        # The position being searched, changed in place by `make_move`
+        # and `unmake_move`: the board, one bitboard per player, the chips
+        # in every column, the player to move, the number of chips, the
+        # heuristic score, the Zobrist hash, and whether every move on
+        # the way from the root won the game.
+        self.board = [' ' for i in range(42)]
+        self.bitboards = {'R': 0, 'B': 0}
+        self.heights = [0] * 7
+        self.turn = 'R'
+        self.n_chips = 0
+        self.score = 0
+        self.hash = 0
+        self.won = [False]
+
+        # the model is loaded by `predict` the first time it is needed,
+        # and left out of the evaluation if `model_path` is None
+        self.model_path = model_path
+        self.model = None
+
+        # Given `processes`, `get_move` hands every root action to a pool
+        # of that many processes, each running its own Minimax built from
+        # `self.options`.
+        self.processes = processes
+        self.pool = None
+        self.options = {
+            "max_depth": max_depth, "tt_mb": tt_mb, "batch_leaves": batch_leaves,
+            "model_path": model_path,
+        }
+
+        # an OpeningBook answering for the positions it has, unsearched
+        self.book = book
+
+    def get_move(self, state, time_budget_ms=None):
+        """
+        Return `(best_action, values)` for `state`, where `values` has the
+        value of every available action in column order.
+
+        The search deepens one ply at a time up to `max_depth`. Given
+        `time_budget_ms`, it stops once that many milliseconds have passed
+        and answers from the deepest search that finished, whose depth
+        is left in `self.depth_reached`.
+
+        Positions in `self.book` are answered from the book.
+        """
+
+        if self.book is not None:
+            found = self.book.get_move(state)
+            if found is not None:
+                return found
 
         connect4_board = [' ' for i in range(42)]
 
@@ -28,9 +219,131 @@ class Minimax():
             elif sv == 1:
                 connect4_board[sn] = 'B'
 
-        turn = self.player(connect4_board)
+        if self.processes is not None:
+            return self.get_move_parallel(connect4_board, time_budget_ms)
+
+        # killer moves per depth and history scores per player for move ordering
+        self.nodes = 0
+        self.leaf_cache.clear()
+        self.killers = [[] for _ in range(self.max_depth + 2)]
+        self.history = {'R': [0] * 7, 'B': [0] * 7}
+
+        start = time.perf_counter()
+        best = None
+
+        for depth in range(self.max_depth + 1):
+            # the shallowest search always finishes so there is a move to return
+            if time_budget_ms is not None and depth > 0:
+                self.deadline = start + time_budget_ms / 1000
+            self.search_depth = depth
+
+            try:
+                best = self.search_root(connect4_board)
+            except SearchTimeout:
+                break
+            finally:
+                self.deadline = None
+
+            self.depth_reached = depth
+
+        return best
+
+    def get_move_parallel(self, connect4_board, time_budget_ms):
+        """
+        `get_move` for `connect4_board` spread over `self.processes`
+        processes. Every depth, each root action is searched as its own
+        task, with alpha-beta over the replies as in `search_root`, which
+        also gives every root action an exact value. Tasks share no
+        transposition table, so they visit a few more nodes in all than
+        `search_root`.
+        """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(
+                self.processes, initializer=init_search_worker, initargs=(self.options,)
+            )
+
+        self.set_position(connect4_board)
+        turn = self.turn
+        actions = self.actions()
+
+        # root actions ending the game need no search
+        finished = dict()
+        for action in actions:
+            self.make_move(action)
+            utility = self.utility()
+            if utility is not None:
+                finished[action] = utility
+            self.unmake_move(action)
+
+        tasks = [action for action in actions if action not in finished]
+        best = None
+        self.nodes = 0
+        deadline = None if time_budget_ms is None else time.time() + time_budget_ms / 1000
+
+        for depth in range(self.max_depth + 1):
+            # the shallowest search always finishes so there is a move to return
+            results = self.pool.map(search_subtree, [
+                (connect4_board, action, depth, deadline if depth > 0 else None)
+                for action in tasks
+            ], chunksize=1)
+            self.nodes += sum(nodes for value, nodes in results)
+            if any(value is None for value, nodes in results):
+                break
 
-        actions = self.actions(connect4_board)
+            task_values = dict(zip(tasks, [value for value, nodes in results]))
+            values = [
+                finished[action] if action in finished else task_values[action]
+                for action in actions
+            ]
+            best_v = max(values) if turn == 'R' else min(values)
+            best = actions[values.index(best_v)], values
+            self.depth_reached = depth
+
+        return best
+
+    def search_subtree(self, connect4_board, action, depth, deadline):
+        """
+        Return the value of `connect4_board` after `action`, searched
+        as part of a root search to `depth` that must finish by the
+        `time.time()` `deadline`, if not None.
+        """
+        if depth == 0:
+            # a new root search, see `get_move_parallel`
+            self.leaf_cache.clear()
+            self.killers = [[] for _ in range(self.max_depth + 2)]
+            self.history = {'R': [0] * 7, 'B': [0] * 7}
+
+        self.search_depth = depth
+        if deadline is not None:
+            self.deadline = time.perf_counter() + deadline - time.time()
+
+        try:
+            self.set_position(connect4_board)
+            self.make_move(action)
+            if self.turn == 'R':
+                return self.max_value(0, -float('inf'), float('inf'))
+            return self.min_value(0, -float('inf'), float('inf'))
+        finally:
+            self.deadline = None
+
+    def close(self):
+        """
+        Shut down the process pool of a parallel Minimax.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def search_root(self, connect4_board):
+        """
+        Search every action of `connect4_board` to `self.search_depth`
+        and return `(best_action, values)`.
+        """
+
+        self.set_position(connect4_board)
+        turn = self.turn
+
+        actions = self.actions()
 
         best_action = actions[0]
         values = []
@@ -41,8 +354,10 @@ class Minimax():
             local_best_min_v = -float('inf')
 
             for action in actions:
-                self.current_depth = 0
-                min_v = self.min_value(self.result(connect4_board, action))
+                # every root action gets an exact value, not a bound
+                self.make_move(action)
+                min_v = self.min_value(0, -float('inf'), float('inf'))
+                self.unmake_move(action)
 
                 # print(f"Action: {action + 1}, Min Value: {min_v}")
                 values.append(min_v)
@@ -57,8 +372,9 @@ class Minimax():
             local_best_max_v = float('inf')
 
             for action in actions:
-                self.current_depth = 0
-                max_v = self.max_value(self.result(connect4_board, action))
+                self.make_move(action)
+                max_v = self.max_value(0, -float('inf'), float('inf'))
+                self.unmake_move(action)
 
                 # print(f"Action: {action + 1}, Max Value: {max_v}")
                 values.append(max_v)
@@ -78,105 +394,257 @@ class Minimax():
     def player(self, board):
         return 'B' if board.count('R') > board.count('B') else 'R'
 
-    def is_tie(self, board):
-        return len([sq for sq in board if sq == ' ']) == 0
-
-    def utility(self, board):
-        return 0 if self.is_tie(board) else -1000 if self.player(board) == "R" else 1000
-
-    def terminal(self, board):
-        # use modulo 7 to detect new row
-        row = 0
-        for sq in range(42):
-            if sq % 7 == 0:
-                row += 1
-
-            distance_to_new_row = 7 * row - (sq + 1)
-            distance_to_column_end = [i for i in range(6) if (sq + 1) + i * 7 > 35][0]
-
-            if board[sq] == ' ':
+    def set_position(self, board):
+        """
+        Set up the position to search from the 'R'/'B'/' ' list `board`.
+        """
+        self.board = board[:]
+        self.bitboards = {'R': 0, 'B': 0}
+        self.heights = [0] * 7
+        self.turn = self.player(board)
+        self.n_chips = 0
+        self.score = 0
+        self.hash = zobrist_hash(board)
+        self.won = [False]
+
+        for sq, chip in enumerate(board):
+            if chip == ' ':
                 continue
+            col, height = sq % 7, HEIGHT - 1 - sq // 7
+            self.bitboards[chip] |= 1 << (col * (HEIGHT + 1) + height)
+            self.heights[col] = max(self.heights[col], height + 1)
+            self.n_chips += 1
+            self.score += self.square_scores[chip][sq]
+
+    def make_move(self, action):
+        """
+        Drop a chip of the player to move in column `action`.
+        """
+        turn = self.turn
+        height = self.heights[action]
+        sq = (HEIGHT - 1 - height) * 7 + action
+        bit = 1 << (action * (HEIGHT + 1) + height)
+
+        self.board[sq] = turn
+        self.bitboards[turn] |= bit
+        self.heights[action] = height + 1
+        self.n_chips += 1
+        self.score += self.square_scores[turn][sq]
+        self.hash ^= ZOBRIST[sq][turn]
+        self.won.append(is_win_through(self.bitboards[turn], bit))
+        self.turn = 'B' if turn == 'R' else 'R'
+
+    def unmake_move(self, action):
+        """
+        Take back the chip `make_move(action)` dropped.
+        """
+        turn = 'B' if self.turn == 'R' else 'R'
+        height = self.heights[action] - 1
+        sq = (HEIGHT - 1 - height) * 7 + action
+
+        self.board[sq] = ' '
+        self.bitboards[turn] ^= 1 << (action * (HEIGHT + 1) + height)
+        self.heights[action] = height
+        self.n_chips -= 1
+        self.score -= self.square_scores[turn][sq]
+        self.hash ^= ZOBRIST[sq][turn]
+        self.won.pop()
+        self.turn = turn
+
+    def utility(self):
+        """
+        Return the value of the position if the game is over, else None.
+        """
+        if self.won[-1]:
+            # the player who just moved won
+            return -1000 if self.turn == 'R' else 1000
+        if self.n_chips == 42:
+            return 0
+        return None
+
+    def actions(self):
+        return [col for col in range(7) if self.heights[col] < HEIGHT]
+
+    def ordered_actions(self, depth, best_move=None):
+        """
+        Return the actions of the position with the ones most likely to
+        cause a cutoff first: `best_move` from the transposition table,
+        killer moves at `depth`, then by history score, then center
+        columns first.
+        """
+        killers = self.killers[depth]
+        history = self.history[self.turn]
+        return sorted(
+            self.actions(),
+            key=lambda action: (
+                action != best_move, action not in killers,
+                -history[action], CENTER_FIRST.index(action)
+            )
+        )
+
+    def store_cutoff(self, action, depth):
+        """
+        Remember that `action` caused a cutoff in the position at `depth`.
+        """
+        killers = self.killers[depth]
+        if action not in killers:
+            killers.insert(0, action)
+            del killers[2:]
+        self.history[self.turn][action] += (self.search_depth + 2 - depth) ** 2
+
+    def predict(self, boards):
+        """
+        Return the model's score of every board in `boards`,
+        all of them in a single call to the model.
+        """
+        if self.model_path is None:
+            return [0] * len(boards)
+        if self.model is None:
+            self.model = load_model(self.model_path)
+
+        squares = np.frombuffer(''.join(map(''.join, boards)).encode(), dtype=np.uint8)
+        conv_data = CHIP_INPUTS[squares].reshape(len(boards), len(boards[0]))
+        return [float(row[0]) for row in self.model.predict(conv_data)]
+
+    def score_children(self):
+        """
+        Score every child of the position that the search would evaluate
+        and has no model score yet, all in one call to the model. Children
+        are set up square by square rather than by `make_move`, as some of
+        them are never searched.
+        """
+        turn = self.turn
+        hashes, boards = [], []
+        for action in self.actions():
+            height = self.heights[action]
+            sq = (HEIGHT - 1 - height) * 7 + action
+            bit = 1 << (action * (HEIGHT + 1) + height)
+            h = self.hash ^ ZOBRIST[sq][turn]
+            # finished games are never evaluated
+            if h in self.leaf_cache or self.n_chips == 41 or is_win_through(self.bitboards[turn] | bit, bit):
+                continue
+            board = self.board[:]
+            board[sq] = turn
+            hashes.append(h)
+            boards.append(board)
+        if boards:
+            self.leaf_cache.update(zip(hashes, self.predict(boards)))
+
+    def evaluate(self):
+
+        if self.hash not in self.leaf_cache:
+            self.leaf_cache[self.hash] = self.predict([self.board])[0]
+
+        return self.score + self.leaf_cache[self.hash]
+
+    def probe(self, h, depth, alpha, beta):
+        """
+        Look up the position with hash `h` to be searched at `depth`.
+        Return `(value, best_move)` where `value` is None unless the
+        stored value settles the search within `alpha` and `beta`.
+        """
+        entry = self.tt.probe(h)
+        if entry is None:
+            return None, None
+
+        value, searched_depth, kind, best_move = entry
+        if searched_depth >= self.search_depth - depth and (
+            kind == EXACT
+            or kind == LOWER and value >= beta
+            or kind == UPPER and value <= alpha
+        ):
+            return value, best_move
+        return None, best_move
+
+    def store(self, h, depth, alpha, beta, v, best_move):
+        """
+        Store the value `v` of the position with hash `h` searched at
+        `depth` with the window `alpha`, `beta` it was searched with.
+        """
+        kind = UPPER if v <= alpha else LOWER if v >= beta else EXACT
+        self.tt.store(h, v, self.search_depth - depth, kind, best_move)
+
+    def tick(self):
+        """
+        Count a searched node and raise SearchTimeout past the deadline.
+        """
+        self.nodes += 1
+        # leaf evaluations can be slow, so look at the clock on every node
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+    def min_value(self, depth, alpha, beta):
+        self.tick()
+
+        utility = self.utility()
+        if utility is not None:
+            return utility
+
+        if depth > self.search_depth:
+            return self.evaluate()
+
+        h = self.hash
+        v, best_move = self.probe(h, depth, alpha, beta)
+        if v is not None:
+            return v
 
-            # 4 horizontally
-            if distance_to_new_row >= 3 and board[sq] == board[sq + 1] and board[sq] == board[sq + 2] and board[sq] == board[sq + 3]:
-                return True
-            # 4 vertically
-            elif distance_to_column_end > 2 and board[sq] == board[sq + 7] and board[sq] == board[sq + 14] and board[sq] == board[sq + 21]:
-                return True
-            # 4 diagonally
-            elif distance_to_new_row >= 3 and distance_to_column_end >= 2 and sq + 24 < len(board) and board[sq] == board[sq + 8] and board[sq] == board[sq + 16] and board[sq] == board[sq + 24]:
-                return True
-            elif distance_to_new_row >= 3 and distance_to_column_end <= 2 and 0 <= sq - 18 < len(board) and board[sq] == board[sq - 6] and board[sq] == board[sq - 12] and board[sq] == board[sq - 18]:
-                return True
-
-        return self.is_tie(board)
-
-    def actions(self, board):
-        return [sn for sn in range(7) if board[sn] == ' ']
-
-    def result(self, board, action):
-        result = board[:]
-        for r in range(6):
-            current_sq = board[action + 35 - r * 7]
-            if current_sq == ' ':
-                result[action + 35 - r * 7] = self.player(board)
+        v = float('inf')
+        window = alpha, beta
+
+        batch = depth == self.search_depth and self.batch_leaves and self.model_path is not None
+
+        for i, action in enumerate(self.ordered_actions(depth, best_move)):
+            # the first child often cuts off alone, see `batch_leaves`
+            if batch and i == 1:
+                self.score_children()
+            self.make_move(action)
+            max_v = self.max_value(depth + 1, alpha, beta)
+            self.unmake_move(action)
+            if max_v < v:
+                v = max_v
+                best_move = action
+            if v <= alpha:
+                self.store_cutoff(action, depth)
                 break
-        return result
-
-    def evaluate(self, board):
+            beta = min(beta, v)
 
-        total_score = 0
-        for vn, values in enumerate(self.heuristic):
-            for value in values:
-                if value < 0 and board[vn] == 'B':
-                    total_score += value
-                elif value > 0 and board[vn] == 'R':
-                    total_score += value
-
-        conv_data = []
-
-        for sq in board:
-            if sq.isdigit() or sq == ' ':
-                conv_data.append(0)
-            elif sq == 'R':
-                conv_data.append(1)
-            else:
-                conv_data.append(-1)  
-
-        c4_board = pd.Series(conv_data, index=[f"pos_{sn + 1}" for sn, sv in enumerate(board)])
-
-        total_score += self.model.predict([c4_board])[0][0]
-
-        return total_score
-
-    def min_value(self, board):
-        if self.terminal(board):
-            return self.utility(board)
-
-        if self.current_depth > self.max_depth:
-            return self.evaluate(board)
-
-        self.current_depth += 1
-        v = float('inf')
+        self.store(h, depth, *window, v, best_move)
+        return v
 
-        for action in self.actions(board):
-            max_v = self.max_value(self.result(board, action))
-            v = min(v, max_v)
+    def max_value(self, depth, alpha, beta):
+        self.tick()
 
-        return v
+        utility = self.utility()
+        if utility is not None:
+            return utility
 
-    def max_value(self, board):
-        if self.terminal(board):
-            return self.utility(board)
+        if depth > self.search_depth:
+            return self.evaluate()
 
-        if self.current_depth > self.max_depth:
-            return self.evaluate(board)
+        h = self.hash
+        v, best_move = self.probe(h, depth, alpha, beta)
+        if v is not None:
+            return v
 
-        self.current_depth += 1
         v = -float('inf')
+        window = alpha, beta
+
+        batch = depth == self.search_depth and self.batch_leaves and self.model_path is not None
+
+        for i, action in enumerate(self.ordered_actions(depth, best_move)):
+            # the first child often cuts off alone, see `batch_leaves`
+            if batch and i == 1:
+                self.score_children()
+            self.make_move(action)
+            min_v = self.min_value(depth + 1, alpha, beta)
+            self.unmake_move(action)
+            if min_v > v:
+                v = min_v
+                best_move = action
+            if v >= beta:
+                self.store_cutoff(action, depth)
+                break
+            alpha = max(alpha, v)
 
-        for action in self.actions(board):
-            min_v = self.min_value(self.result(board, action))
-            v = max(v, min_v)
-
-        return v
\ No newline at end of file
+        self.store(h, depth, *window, v, best_move)
+        return v
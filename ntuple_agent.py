@@ -0,0 +1,204 @@
+import math
+import random
+
+import numpy as np
+
+from q_connect4 import Connect4, WIDTH, HEIGHT, SQUARE_BITS, is_win, is_win_through
+
+# A cell of a tuple is in one of 4 states, as seen by the player who
+# made the last move: empty and not playable yet, empty and playable,
+# a chip of that player, or a chip of the opponent.
+CELL_STATES = 4
+
+
+def line_cells():
+    """
+    Return every line of four squares of the board as a tuple of
+    `Connect4.board` indices, where square `row * 7 + col` has row 0 at
+    the top.
+    """
+    lines = []
+    for row in range(HEIGHT):
+        for col in range(WIDTH):
+            for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                end_row, end_col = row + 3 * d_row, col + 3 * d_col
+                if 0 <= end_row < HEIGHT and 0 <= end_col < WIDTH:
+                    lines.append(tuple((row + i * d_row) * WIDTH + col + i * d_col for i in range(4)))
+    return lines
+
+
+def mirror_cells(cells):
+    return tuple(sq - sq % WIDTH + WIDTH - 1 - sq % WIDTH for sq in cells)
+
+
+def tuple_layout():
+    """
+    Return `(cells, tables)`: the squares of every tuple evaluated, as an
+    `(n, 4)` array, and the weight table each one reads. A line and its
+    mirror image are both evaluated and read the same table, each cell
+    of the mirror image standing for its twin in the line, so that a
+    position and its mirror image get the same value. A line that is
+    its own mirror image is evaluated once.
+    """
+    cells, tables = [], []
+    seen = set()
+    n_tables = 0
+    for line in line_cells():
+        # the mirror image of a line may list its squares in another order
+        if frozenset(line) in seen:
+            continue
+        mirrored = mirror_cells(line)
+        seen.update((frozenset(line), frozenset(mirrored)))
+        pair = [line] if frozenset(mirrored) == frozenset(line) else [line, mirrored]
+        cells += pair
+        tables += [n_tables] * len(pair)
+        n_tables += 1
+    return np.array(cells), np.array(tables)
+
+
+TUPLE_CELLS, TUPLE_TABLES = tuple_layout()
+N_TABLES = TUPLE_TABLES.max() + 1
+# weights of the cell states of a tuple in the index of its table entry
+CELL_POWERS = CELL_STATES ** np.arange(TUPLE_CELLS.shape[1])
+
+
+class NTupleConnect4Agent(Connect4):
+
+    def __init__(self, alpha=0.5, epsilon=0.1, book=None):
+        """
+        Initialize AI with an n-tuple network, an alpha (learning) rate,
+        and an epsilon rate.
+
+        The network values the board after a move, from the point of view
+        of the player who made it, between -1 (lost) and 1 (won): the
+        `tanh` of the sum over all lines of four squares of the weight in
+        the line's table indexed by the states of its four cells. Its
+        memory is the `weights` matrix, one row of `4 ** 4` weights per
+        table, however long it trains.
+
+        `alpha` is shared out over the tuples, so every weight of an
+        update moves by `alpha / len(TUPLE_CELLS)` of the error.
+
+        There is no table of Q-values, so `q` is None.
+
+        The best action of a state in the OpeningBook `book`, if given,
+        is taken over the network's choice.
+        """
+        self.weights = np.zeros((N_TABLES, CELL_STATES ** TUPLE_CELLS.shape[1]), dtype=np.float32)
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.q = None
+        self.book = book
+
+    def afterstates(self, state):
+        """
+        Return `(actions, boards, mover, wins)` for every available action
+        of `state`: the boards after it as an `(n, 42)` int8 array with -1
+        for empty squares, the player making it, and whether it wins.
+        """
+        actions = self.available_actions(state)
+        mover = (len(state) - state.count(' ')) % 2
+        board = np.array([-1 if sq == ' ' else sq for sq in state], dtype=np.int8)
+        chips = sum(bit for bit, sq in zip(SQUARE_BITS, state) if sq == mover)
+
+        boards = np.repeat(board[None], len(actions), axis=0)
+        wins = np.zeros(len(actions), dtype=bool)
+        for i, action in enumerate(actions):
+            sq = max(sq for sq in range(action, len(state), WIDTH) if state[sq] == ' ')
+            boards[i, sq] = mover
+            wins[i] = is_win_through(chips | SQUARE_BITS[sq], SQUARE_BITS[sq])
+        return actions, boards, mover, wins
+
+    def table_indices(self, boards, mover):
+        """
+        Return the entry every tuple reads in its table for every board
+        of `boards`, as an `(n, len(TUPLE_CELLS))` array.
+        """
+        # a square is playable if the square below it is not empty
+        below = np.concatenate([boards[:, WIDTH:], np.zeros((len(boards), WIDTH), dtype=np.int8)], axis=1)
+        cells = np.where(
+            boards == -1,
+            below != -1,
+            np.where(boards == mover, 2, 3),
+        )
+        return (cells[:, TUPLE_CELLS] * CELL_POWERS).sum(axis=2)
+
+    def values(self, indices):
+        return np.tanh(self.weights[TUPLE_TABLES, indices].sum(axis=1))
+
+    def afterstate_values(self, state):
+        """
+        Return `(actions, values)`: the value of the board after every
+        available action of `state`, for the player making it.
+        A winning move is worth 1.
+        """
+        actions, boards, mover, wins = self.afterstates(state)
+        values = self.values(self.table_indices(boards, mover))
+        values[wins] = 1
+        return actions, values
+
+    def update(self, old_state, action, new_state, reward):
+        """
+        Update the network, given an old state, an action taken in that
+        state, a new resulting state, and the reward received from taking
+        that action, like `QConnect4Agent.update`: the value of the board
+        after `action` moves towards `reward` plus the best value the same
+        player can reach from `new_state`, unless the game is over.
+        """
+        actions, boards, mover, wins = self.afterstates(old_state)
+        indices = self.table_indices(boards[actions.index(action)][None], mover)[0]
+        value = math.tanh(self.weights[TUPLE_TABLES, indices].sum())
+
+        target = reward + self.best_future_reward(new_state)
+        error = (target - value) * (1 - value * value)
+        np.add.at(self.weights, (TUPLE_TABLES, indices), self.alpha / len(TUPLE_CELLS) * error)
+
+    def best_future_reward(self, state):
+        """
+        Return the best value of the boards the player to move in `state`
+        can reach, or 0 if the game is over.
+        """
+        actions = self.available_actions(state)
+        if not actions:
+            return 0
+        bitboards = [0, 0]
+        for bit, sq in zip(SQUARE_BITS, state):
+            if sq != ' ':
+                bitboards[sq] |= bit
+        if is_win(bitboards[0]) or is_win(bitboards[1]):
+            return 0
+        return float(self.afterstate_values(state)[1].max())
+
+    def choose_action(self, state, epsilon=True):
+        """
+        Given a state `state`, return an action `i` to take.
+
+        If `epsilon` is `False`, then return the available action
+        leading to the board with the highest value.
+
+        If `epsilon` is `True`, then with probability
+        `self.epsilon` choose a random available action,
+        otherwise choose the best action available.
+        """
+        if epsilon and random.random() <= self.epsilon:
+            return random.choice(self.available_actions(state))
+
+        if self.book is not None:
+            found = self.book.get_move(state)
+            if found is not None:
+                return found[0]
+
+        actions, values = self.afterstate_values(state)
+        return actions[int(values.argmax())]
+
+    def save(self, path):
+        """
+        Write the weights to `path` as a NumPy `.npy` file.
+        """
+        np.save(path, self.weights)
+
+    @classmethod
+    def load(cls, path, alpha=0.5, epsilon=0.1):
+        agent = cls(alpha=alpha, epsilon=epsilon)
+        agent.weights = np.load(path)
+        return agent
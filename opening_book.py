@@ -0,0 +1,104 @@
+import sys
+
+import numpy as np
+
+from minimax import Minimax
+from q_connect4 import Connect4, WIDTH, board_key, mirror_key
+from q_table import MmapQTable, save_table
+
+
+def opening_positions(plies):
+    """
+    Return a dict mapping the mirror-canonical `board_key` of every
+    position reached in at most `plies` moves, where the game is not
+    over yet, to one `Connect4.board` of that position.
+    """
+    positions = dict()
+    frontier = [Connect4()]
+
+    for ply in range(plies + 1):
+        children = []
+        for game in frontier:
+            key = board_key(game.board)
+            key = min(key, mirror_key(key))
+            if key in positions:
+                continue
+            positions[key] = game.board[:]
+
+            for action in game.available_actions(game.board):
+                child = Connect4()
+                child.board = game.board[:]
+                child.bitboards = game.bitboards[:]
+                child.heights = game.heights[:]
+                child.player = game.player
+                child.moves = game.moves
+                child.move(action)
+                if child.result is None:
+                    children.append(child)
+        frontier = children
+
+    return positions
+
+
+def build_book(path, plies, minimax):
+    """
+    Search every position up to `plies` moves deep with the Minimax
+    `minimax` and write the values of their actions to `path`.
+    """
+    positions = opening_positions(plies)
+
+    keys = np.fromiter(positions.keys(), dtype=np.uint64, count=len(positions))
+    values = np.full((len(positions), WIDTH), np.nan, dtype=np.float32)
+    for i, board in enumerate(positions.values()):
+        best_action, action_values = minimax.get_move(board)
+        actions = [col for col in range(WIDTH) if board[col] == ' ']
+        values[i, actions] = action_values
+
+        # rows are kept in the orientation of the key
+        key = board_key(board)
+        if mirror_key(key) < key:
+            values[i] = values[i, ::-1]
+
+    save_table(path, keys, values)
+
+
+class OpeningBook(MmapQTable):
+
+    def __init__(self, path):
+        """
+        Open the opening book written by `build_book` at `path`.
+
+        A book is saved in the same format as a QTable: the sorted
+        mirror-canonical keys of its positions, binary searched in
+        place, and a row with the Minimax value of every action of each,
+        NaN for full columns.
+        """
+        super().__init__(path)
+
+    def get_move(self, state):
+        """
+        Return `(best_action, values)` for `state` like `Minimax.get_move`,
+        or None if `state` is not in the book.
+        """
+        key = board_key(state)
+        mirrored = mirror_key(key)
+        row = self.row(min(key, mirrored))
+        if row is None:
+            return None
+        if mirrored < key:
+            row.reverse()
+
+        actions = [col for col in range(WIDTH) if state[col] == ' ']
+        values = [row[action] for action in actions]
+
+        # player 0 plays first and maximizes the values
+        player = (len(state) - state.count(' ')) % 2
+        best = max(values) if player == 0 else min(values)
+        return actions[values.index(best)], values
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        sys.exit("usage: python opening_book.py PLIES DEPTH BOOK.c4b")
+
+    build_book(sys.argv[3], int(sys.argv[1]), Minimax(max_depth=int(sys.argv[2])))
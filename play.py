@@ -1,61 +1,95 @@
+import os
+import random
+
+from opening_book import OpeningBook
 from q_connect4_agent import QConnect4Agent
 from q_connect4 import Connect4
+from q_table import MmapQTable
 from minimax import Minimax
+from solver import Solver
 
-def play(q_agent, human=0, helper=False, helper_depth=20):
+def play(q_agent, human=0, helper=False, helper_depth=20, helper_time_ms=2000, helper_solver=False):
     """
     Play human game against the QAgent.
     `human` can be set to 0 or 1 to specify whether
     human moves first or second.
+    The `helper` search goes at most `helper_depth` deep
+    and takes at most about `helper_time_ms` per move.
+    With `helper_solver`, the helper is a Solver playing perfectly
+    whenever it solves the position within `helper_time_ms`.
     """
 
-    connect4 = Connect4()
-    helper = Minimax(max_depth=helper_depth) if helper else None
+    if helper and helper_solver:
+        helper = Solver()
+    elif helper:
+        helper = Minimax(max_depth=helper_depth, book=getattr(q_agent, "book", None))
+    else:
+        helper = None
 
     while True:
 
-        for l in range(0, 42, 7):
-            row = ''.join([f"{connect4.board[l + i]}|" for i in range(7)])
-            print(row[:13])
-            print('-+-+-+-+-+-+-')
-
-        actions = connect4.available_actions(connect4.board)
-
-        if connect4.player == human:
-            print("Your Move.")
-
-            while True:
-                column = int(input().strip()) - 1
-                
-                if not column in actions:
-                    print('That place is already filled or invalid. Still your move.')
-                else:
-                    break
-
-            # column, values = helper.get_move(connect4.board)
-        else:
-            print("QAgent's Move.")
-
-            if helper:
-                action, values = helper.get_move(connect4.board)
-                if values.count(1000) >= 1 or values.count(-1000) >= 1:
-                    column = action 
-                else:
-                    column = q_agent.choose_action(connect4.board, epsilon=False)
+        connect4 = Connect4()
+
+        while True:
+
+            for l in range(0, 42, 7):
+                row = ''.join([f"{connect4.board[l + i]}|" for i in range(7)])
+                print(row[:13])
+                print('-+-+-+-+-+-+-')
+
+            actions = connect4.available_actions(connect4.board)
+
+            if connect4.player == human:
+                print("Your Move.")
+
+                while True:
+                    column = int(input().strip()) - 1
+
+                    if not column in actions:
+                        print('That place is already filled or invalid. Still your move.')
+                    else:
+                        break
+
+                # column, values = helper.get_move(connect4.board)
             else:
-                column = q_agent.choose_action(connect4.board, epsilon=False)
+                print("QAgent's Move.")
 
-            print(f"QAgent put a chip in column {column + 1}.")
+                helper_move = None
+                if helper:
+                    helper_move = helper.get_move(connect4.board, time_budget_ms=helper_time_ms)
+                column = agent_move(q_agent, connect4.board, helper_move)
 
-        connect4.move(column)
+                print(f"QAgent put a chip in column {column + 1}.")
 
-        if connect4.result is not None:
-            print("\nGAME OVER\n")
+            connect4.move(column)
 
-            winner = "Human" if connect4.result == human else "QAgent"
-            print(f"Winner is {winner}")
+            if connect4.result is not None:
+                print("\nGAME OVER\n")
 
+                winner = "Human" if connect4.result == human else "QAgent"
+                print(f"Winner is {winner}")
+
+                break
+
+        # a new game starts in the same call, so the stack stays the same
+        if input("Play again?\n").lower() != "y":
             break
-            
-    if input("Play again?\n").lower() == "y":
-        play(q_agent)
+
+
+def agent_move(q_agent, board, helper_move=None):
+    """
+    Return the column the QAgent plays in `board`, or the helper's move
+    when `helper_move`, the `(action, values)` of its search, found a
+    forced win or loss.
+    """
+    if helper_move is not None:
+        action, values = helper_move
+        if values.count(1000) >= 1 or values.count(-1000) >= 1:
+            return action
+    return q_agent.choose_action(board, epsilon=False)
+
+if __name__ == "__main__":
+    # play against the table saved by `main_threading.py` without loading it
+    book = OpeningBook('opening_book.c4b') if os.path.exists('opening_book.c4b') else None
+    q_agent = QConnect4Agent(q=MmapQTable('q_agent_q.c4q'), book=book)
+    play(q_agent=q_agent, human=random.randint(0, 1))
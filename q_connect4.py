@@ -2,6 +2,84 @@ import math
 import random
 import time
 
+WIDTH = 7
+HEIGHT = 6
+
+
+# Each column of a bitboard takes HEIGHT + 1 bits, bottom row first.
+# The spare top bit of every column stays empty so that shifted lines
+# can never wrap around into the next column.
+BOTTOM_MASK = sum(1 << (col * (HEIGHT + 1)) for col in range(WIDTH))
+COLUMN_MASK = (1 << (HEIGHT + 1)) - 1
+
+# bitboard bit of every square of `Connect4.board`
+SQUARE_BITS = [
+    1 << ((sq % WIDTH) * (HEIGHT + 1) + HEIGHT - 1 - sq // WIDTH)
+    for sq in range(WIDTH * HEIGHT)
+]
+
+
+def board_key(state):
+    """
+    Pack the 42-square `state` list into a single int under 2 ** 49.
+
+    Every column contributes the chips of player 0 plus a marker bit
+    just above its top chip, which makes the key unique to the state.
+    """
+    chips = 0
+    mask = 0
+    for bit, sq in zip(SQUARE_BITS, state):
+        if sq == ' ':
+            continue
+        mask |= bit
+        if sq == 0:
+            chips |= bit
+    return chips + mask + BOTTOM_MASK
+
+
+def mirror_key(key):
+    """
+    Return the `board_key` of the left/right mirror image
+    of the state packed as `key`.
+    """
+    mirrored = 0
+    for col in range(WIDTH):
+        mirrored = mirrored << (HEIGHT + 1) | (key >> col * (HEIGHT + 1)) & COLUMN_MASK
+    return mirrored
+
+
+def is_win(bitboard):
+    """
+    Check if the chips in `bitboard` contain four in a row
+    vertically, horizontally or diagonally.
+    """
+    for shift in (1, HEIGHT, HEIGHT + 1, HEIGHT + 2):
+        pairs = bitboard & (bitboard >> shift)
+        if pairs & (pairs >> 2 * shift):
+            return True
+    return False
+
+
+def is_win_through(bitboard, bit):
+    """
+    Check if the chip at `bit` in `bitboard` is part of four in a row.
+    Only the four lines running through that chip are looked at.
+    """
+    for shift in (1, HEIGHT, HEIGHT + 1, HEIGHT + 2):
+        count = 1
+        probe = bit << shift
+        while probe & bitboard:
+            count += 1
+            probe <<= shift
+        probe = bit >> shift
+        while probe & bitboard:
+            count += 1
+            probe >>= shift
+        if count >= 4:
+            return True
+    return False
+
+
 class Connect4():
 
     def __init__(self):
@@ -11,10 +89,22 @@ class Connect4():
             - `board`: the state of the game
             - `player`: whoever is currently playing
             - `winner`: the winner of the game once there is one
+            - `moves`: the number of chips played so far
+            - `last_row`, `last_col`: the square of the last chip played
+
+        The game itself is played on `bitboards`, one integer per
+        player with a bit set for every chip, and `heights`, the number
+        of chips in every column. `board` is kept in step with them as
+        a list of 42 squares for printing and for existing callers.
         """
         self.board = [' ' for sq in range(42)]
+        self.bitboards = [0, 0]
+        self.heights = [0 for col in range(WIDTH)]
         self.player = 0
         self.result = None
+        self.moves = 0
+        self.last_row = None
+        self.last_col = None
 
     def available_actions(self, state):
         """
@@ -33,36 +123,15 @@ class Connect4():
 
     def is_tie(self):
         """
-        Check if the current state of `board` is tie  
+        Check if the current state of `board` is tie
         """
-        return len([sq for sq in self.board if sq == ' ']) == 0
+        return self.moves == WIDTH * HEIGHT
 
     def terminal(self):
         """
         Check if the current state of `board` is terminal
         """
-        row = 0
-        for sq in range(42):
-            if sq % 7 == 0:
-                row += 1
-
-            distance_to_new_row = 7 * row - (sq + 1)
-            distance_to_column_end = [i for i in range(6) if (sq + 1) + i * 7 > 35][0]
-
-            if self.board[sq] == ' ':
-                continue
-
-            # 4 horizontally
-            if distance_to_new_row >= 3 and self.board[sq] == self.board[sq + 1] and self.board[sq] == self.board[sq + 2] and self.board[sq] == self.board[sq + 3]:
-                return True
-            # 4 vertically
-            elif distance_to_column_end > 2 and self.board[sq] == self.board[sq + 7] and self.board[sq] == self.board[sq + 14] and self.board[sq] == self.board[sq + 21]:
-                return True
-            # 4 diagonally
-            elif distance_to_new_row >= 3 and distance_to_column_end >= 2 and sq + 24 < len(self.board) and self.board[sq] == self.board[sq + 8] and self.board[sq] == self.board[sq + 16] and self.board[sq] == self.board[sq + 24]:
-                return True
-            elif distance_to_new_row >= 3 and distance_to_column_end <= 2 and 0 <= sq - 18 < len(self.board) and self.board[sq] == self.board[sq - 6] and self.board[sq] == self.board[sq - 12] and self.board[sq] == self.board[sq - 18]:
-                return True
+        return is_win(self.bitboards[0]) or is_win(self.bitboards[1])
 
     def move(self, action):
         """
@@ -70,15 +139,24 @@ class Connect4():
         `action` must be an int `i`.
         """
 
-        for r in range(6):
-            current_sq = action + 35 - r * 7
-            if self.board[current_sq] == ' ':
-                self.board[action + 35 - r * 7] = self.player
-                break
+        height = self.heights[action]
+        if height == HEIGHT:
+            # a full column leaves the board as it was
+            self.switch_player()
+            return
+
+        self.last_row = HEIGHT - 1 - height
+        self.last_col = action
+        self.board[self.last_row * WIDTH + action] = self.player
+        bit = 1 << (action * (HEIGHT + 1) + height)
+        self.bitboards[self.player] |= bit
+        self.heights[action] = height + 1
+        self.moves += 1
 
-        if self.terminal():
+        # only a line through the chip just played can be new
+        if is_win_through(self.bitboards[self.player], bit):
             self.result = self.player
         elif self.is_tie():
             self.result = 2
         else:
-            self.switch_player()
\ No newline at end of file
+            self.switch_player()
@@ -1,20 +1,84 @@
 import random
 
-from q_connect4 import Connect4
+from q_connect4 import Connect4, WIDTH, board_key, mirror_key
+from q_table import QTable
+
+
+def canonical_key(state):
+    """
+    Return `(key, mirrored)` where `key` is the lesser of the `board_key`
+    of `state` and of its left/right mirror image, and `mirrored` tells
+    whether `key` belongs to the mirror image, in which case action `i`
+    in `state` is action `6 - i` under `key`.
+    """
+    key = board_key(state)
+    mirrored = mirror_key(key)
+    return (mirrored, True) if mirrored < key else (key, False)
+
+
+def canonical_action(key, action):
+    """
+    Return `(key, action)` under the canonical key of the state packed as
+    `key`, see `canonical_key`. A state that is its own mirror image has
+    one Q-value for action `i` and its mirror image `6 - i`, in column
+    `min(i, 6 - i)`.
+    """
+    mirrored = mirror_key(key)
+    if mirrored < key:
+        return mirrored, WIDTH - 1 - action
+    if mirrored == key:
+        return key, min(action, WIDTH - 1 - action)
+    return key, action
+
+
+def migrate_q(q):
+    """
+    Convert a Q-learning dictionary, as saved by older versions in
+    `q_agent_dict.pkl`, to a QTable of mirror-canonical states.
+    Keys can either be `(tuple(state), action)` pairs or ints packing
+    `board_key(state)` and `action` as `key << 3 | action`.
+    A QTable is returned as it is.
+    """
+    if isinstance(q, QTable):
+        return q
+
+    table = QTable(capacity=max(1024, len(q)))
+    for key, value in q.items():
+        if isinstance(key, tuple):
+            state, action = key
+            key = board_key(state)
+        else:
+            key, action = key >> 3, key & 7
+        key, action = canonical_action(key, action)
+        r = table.insert(key)
+        table.values[r, action] = value
+    return table
+
 
 class QConnect4Agent(Connect4):
 
-    def __init__(self, alpha=0.5, epsilon=0.1, q=dict()):
+    def __init__(self, alpha=0.5, epsilon=0.1, q=None, book=None):
         """
-        Initialize AI with an empty Q-learning dictionary,
+        Initialize AI with an empty Q-learning table,
         an alpha (learning) rate, and an epsilon rate.
 
-        The Q-learning dictionary maps `(state, action)`
+        The Q-learning table maps `(state, action)`
         pairs to a Q-value (a number).
-         - `state` is a tuple of the current board state
+         - `state` is packed into an int by `board_key`
+           and picks a row of the table
          - `action` is an int of the move made
+           and picks a column of that row
+
+        A state and its left/right mirror image share one row, stored
+        under whichever of the two has the lesser key (`canonical_key`),
+        and a state that is its own mirror image keeps one Q-value for
+        an action and its mirror image (`canonical_action`).
+
+        The best action of a state in the OpeningBook `book`, if given,
+        is taken over the Q-values.
         """
-        self.q = q
+        self.q = QTable() if q is None else q
+        self.book = book
         self.alpha = alpha
         self.epsilon = epsilon
 
@@ -24,9 +88,26 @@ class QConnect4Agent(Connect4):
         in that state, a new resulting state, and the reward received
         from taking that action.
         """
-        old = self.get_q_value(old_state, action)
+        key, action = canonical_action(board_key(old_state), action)
+        r = self.q.insert(key, action)
+        old = self.q.values[r, action]
         best_future = self.best_future_reward(new_state)
-        self.update_q_value(old_state, action, old, reward, best_future)
+        self.q.values[r, action] = old + self.alpha * (reward + best_future - old)
+
+    def get_q_values(self, state):
+        """
+        Return the Q-values of every action in the state `state`,
+        or None if no Q-value exists yet in `self.q`.
+        """
+        key = board_key(state)
+        mirrored = mirror_key(key)
+        row = self.q.row(min(key, mirrored))
+        if row is not None and mirrored < key:
+            row.reverse()
+        elif row is not None and mirrored == key:
+            # the right half shares the Q-values of the left half
+            row[WIDTH // 2 + 1:] = row[WIDTH // 2 - 1::-1]
+        return row
 
     def get_q_value(self, state, action):
         """
@@ -34,7 +115,8 @@ class QConnect4Agent(Connect4):
         If no Q-value exists yet in `self.q`, return 0.
         """
 
-        return self.q[(tuple(state), action)] if (tuple(state), action) in self.q else 0
+        row = self.get_q_values(state)
+        return 0 if row is None else row[action]
 
     def update_q_value(self, state, action, old_q, reward, future_rewards):
         """
@@ -53,7 +135,9 @@ class QConnect4Agent(Connect4):
         """
 
         new_value_estimate = reward + future_rewards
-        self.q[(tuple(state), action)] = old_q + self.alpha * ( new_value_estimate - old_q )
+        key, action = canonical_action(board_key(state), action)
+        r = self.q.insert(key, action)
+        self.q.values[r, action] = old_q + self.alpha * ( new_value_estimate - old_q )
 
     def best_future_reward(self, state):
         """
@@ -66,15 +150,12 @@ class QConnect4Agent(Connect4):
         `state`, return 0.
         """
 
-        rewards = []
-
-        for action in self.available_actions(state):
-            if (tuple(state), action) in self.q:
-                rewards.append(self.q[(tuple(state), action)])
-            else:
-                rewards.append(0)
+        actions = self.available_actions(state)
+        row = self.get_q_values(state)
 
-        return max(rewards) if rewards else 0
+        if row is None or not actions:
+            return 0
+        return max([row[action] for action in actions])
 
     def choose_action(self, state, epsilon=True):
         """
@@ -90,6 +171,8 @@ class QConnect4Agent(Connect4):
 
         If multiple actions have the same Q-value, any of those
         options is an acceptable return value.
+
+        The best action is looked up in `self.book` first.
         """
 
         actions = self.available_actions(state)
@@ -97,15 +180,13 @@ class QConnect4Agent(Connect4):
         if epsilon and random.random() <= self.epsilon:
             return random.choice(list(actions))
 
-        best_q_v = -float('inf')
-        best_action = None
+        if self.book is not None:
+            found = self.book.get_move(state)
+            if found is not None:
+                return found[0]
 
-        for action in actions:
-            q_v = 0
-            if (tuple(state), action) in self.q:
-                q_v = self.q[(tuple(state), action)]
-            if q_v >= best_q_v:
-                best_q_v = q_v
-                best_action = action
+        row = self.get_q_values(state)
 
-        return best_action
+        if row is None:
+            return actions[-1]
+        return max(reversed(actions), key=row.__getitem__)
@@ -0,0 +1,118 @@
+import numpy as np
+
+from q_connect4 import WIDTH, HEIGHT
+
+EMPTY = -1
+
+
+class Connect4Batch():
+
+    def __init__(self, n_games, seed=None):
+        """
+        Initialize `n_games` game boards that are played side by side.
+        The batch has
+            - `boards`: an `(n_games, 6, 7)` int8 array, top row first,
+              holding `EMPTY`, 0 or 1 for every square
+            - `heights`: the number of chips in every column of every game
+            - `player`: whoever is currently playing in every game
+            - `moves`: the number of chips played in every game
+            - `final_boards`: the boards of the games finished by the
+              last `move`, taken before they were reset
+        """
+        self.n_games = n_games
+        self.boards = np.full((n_games, HEIGHT, WIDTH), EMPTY, dtype=np.int8)
+        self.heights = np.zeros((n_games, WIDTH), dtype=np.int8)
+        self.player = np.zeros(n_games, dtype=np.int8)
+        self.moves = np.zeros(n_games, dtype=np.int16)
+        self.final_boards = self.boards[:0].copy()
+        self.rng = np.random.default_rng(seed)
+        self._games = np.arange(n_games)
+
+    def reset(self, games=None):
+        """
+        Start over the games selected by `games`, a boolean mask or
+        index array, or every game if `games` is None.
+        """
+        if games is None:
+            games = slice(None)
+        self.boards[games] = EMPTY
+        self.heights[games] = 0
+        self.player[games] = 0
+        self.moves[games] = 0
+
+    def states(self):
+        """
+        Return the boards as an `(n_games, 42)` array in the square
+        order used by `Connect4.board`.
+        """
+        return self.boards.reshape(self.n_games, HEIGHT * WIDTH)
+
+    def available_actions(self):
+        """
+        Return an `(n_games, 7)` boolean mask of the columns that
+        still have room in every game.
+        """
+        return self.heights < HEIGHT
+
+    def random_actions(self):
+        """
+        Return one uniformly random available action for every game.
+        """
+        weights = self.rng.random((self.n_games, WIDTH))
+        weights[~self.available_actions()] = -1
+        return weights.argmax(axis=1)
+
+    def wins(self, player):
+        """
+        Return a boolean array telling which games have four in a row
+        for `player`, where `player` holds one player per game.
+        """
+        chips = self.boards == player[:, None, None]
+
+        horizontal = chips[:, :, :-3] & chips[:, :, 1:-2] & chips[:, :, 2:-1] & chips[:, :, 3:]
+        vertical = chips[:, :-3] & chips[:, 1:-2] & chips[:, 2:-1] & chips[:, 3:]
+        diagonal = (
+            chips[:, :-3, :-3] & chips[:, 1:-2, 1:-2]
+            & chips[:, 2:-1, 2:-1] & chips[:, 3:, 3:]
+        )
+        anti_diagonal = (
+            chips[:, 3:, :-3] & chips[:, 2:-1, 1:-2]
+            & chips[:, 1:-2, 2:-1] & chips[:, :-3, 3:]
+        )
+
+        return (
+            horizontal.any(axis=(1, 2)) | vertical.any(axis=(1, 2))
+            | diagonal.any(axis=(1, 2)) | anti_diagonal.any(axis=(1, 2))
+        )
+
+    def move(self, actions):
+        """
+        Make the move `actions[g]` for the current player of every game `g`.
+        Raise ValueError, moving in no game, unless every action is
+        available in its game.
+
+        Return an int8 array with the result of every game: -1 while the
+        game goes on, the winning player, or 2 for a tie. Finished games
+        are copied to `final_boards` and reset so the batch stays full.
+        """
+        actions = np.asarray(actions)
+        in_range = ((actions >= 0) & (actions < WIDTH)).all()
+        if not in_range or not self.available_actions()[self._games, actions].all():
+            raise ValueError("every action must be an available column of its game")
+        rows = HEIGHT - 1 - self.heights[self._games, actions]
+
+        self.boards[self._games, rows, actions] = self.player
+        self.heights[self._games, actions] += 1
+        self.moves += 1
+
+        result = np.full(self.n_games, -1, dtype=np.int8)
+        won = self.wins(self.player)
+        result[won] = self.player[won]
+        result[~won & (self.moves == WIDTH * HEIGHT)] = 2
+
+        finished = result != -1
+        self.final_boards = self.boards[finished].copy()
+        self.reset(finished)
+        self.player[~finished] ^= 1
+
+        return result
@@ -0,0 +1,125 @@
+import os
+import struct
+import time
+
+import numpy as np
+
+from q_connect4 import WIDTH
+from q_table import QTable
+
+# A log is a sequence of batches, each a header of `LOG_MAGIC` and the
+# number of rows `n`, followed by `n` state keys as uint64 and their rows
+# of Q-values as an `(n, 7)` float32 matrix. A batch holds whole rows,
+# so replaying it twice gives the same table as replaying it once.
+LOG_MAGIC = b"C4QL0001"
+BATCH_HEADER = struct.Struct("<8sQ")
+
+
+class QLog():
+
+    def __init__(self, path, fsync_seconds=5.0):
+        """
+        Open the log of Q-table rows at `path` to append to it.
+
+        Every batch is handed to the OS as soon as it is appended, which
+        survives the process crashing. It is also forced to disk with
+        fsync, which survives the machine crashing, at most every
+        `fsync_seconds`, and on `sync` and `close`.
+        """
+        self.path = path
+        self.file = open(path, "ab")
+        self.fsync_seconds = fsync_seconds
+        self.synced = time.monotonic()
+
+    def append(self, keys, rows):
+        """
+        Append the rows `rows` of the states packed as `keys`,
+        as passed to `QTable.set_rows`.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        self.file.write(BATCH_HEADER.pack(LOG_MAGIC, len(keys)))
+        self.file.write(keys.tobytes())
+        self.file.write(np.asarray(rows, dtype=np.float32).reshape(len(keys), WIDTH).tobytes())
+        self.file.flush()
+
+        if time.monotonic() - self.synced >= self.fsync_seconds:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.synced = time.monotonic()
+
+    def size(self):
+        return self.file.tell()
+
+    def truncate(self):
+        """
+        Empty the log, once its rows are all in a snapshot.
+        """
+        self.file.truncate(0)
+        self.file.seek(0)
+        self.sync()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+def replay_log(path, table):
+    """
+    Apply every batch of the log at `path` to `table` in order and return
+    `(n_rows, n_bytes)`: the number of rows applied and the length of the
+    log they take up. A batch cut short by a crash while it was being
+    written is left out, along with anything after it.
+    """
+    n_rows = 0
+    with open(path, "rb") as f:
+        data = f.read()
+
+    offset = 0
+    while offset + BATCH_HEADER.size <= len(data):
+        magic, n = BATCH_HEADER.unpack_from(data, offset)
+        end = offset + BATCH_HEADER.size + n * (8 + 4 * WIDTH)
+        if magic != LOG_MAGIC or end > len(data):
+            break
+
+        keys = np.frombuffer(data, dtype=np.uint64, count=n, offset=offset + BATCH_HEADER.size)
+        rows = np.frombuffer(data, dtype=np.float32, count=n * WIDTH, offset=offset + BATCH_HEADER.size + 8 * n)
+        table.set_rows(keys, rows.reshape(n, WIDTH))
+        n_rows += n
+        offset = end
+
+    return n_rows, offset
+
+
+def load_checkpoint(snapshot_path, log_path):
+    """
+    Return the QTable saved at `snapshot_path` with the log at `log_path`
+    replayed on top of it. Either file may be missing. A torn batch at
+    the end of the log is cut off so new batches can be appended.
+    """
+    table = QTable.load(snapshot_path) if os.path.exists(snapshot_path) else QTable()
+    if os.path.exists(log_path):
+        n_rows, n_bytes = replay_log(log_path, table)
+        if n_bytes < os.path.getsize(log_path):
+            os.truncate(log_path, n_bytes)
+    return table
+
+
+def compact(table, snapshot_path, log):
+    """
+    Fold the QLog `log` into a new snapshot of `table` at `snapshot_path`
+    and empty the log. `table` must already have every row of the log.
+
+    The snapshot is written next to the old one and then renamed over it,
+    so a crash at any point leaves a snapshot and a log that replay to
+    the same table.
+    """
+    log.sync()
+    tmp_path = snapshot_path + ".tmp"
+    table.save(tmp_path)
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, snapshot_path)
+    log.truncate()
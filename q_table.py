@@ -0,0 +1,528 @@
+import bisect
+import mmap
+import multiprocessing
+import struct
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from q_connect4 import WIDTH
+
+# A saved table is a header of `FILE_MAGIC` and the number of states `n`,
+# followed by the `n` state keys in ascending order as uint64 and then
+# their rows of Q-values as an `(n, 7)` float32 matrix.
+FILE_MAGIC = b"C4QT0001"
+FILE_HEADER = struct.Struct("<8sQ")
+
+# past this fraction of slots in use, probing a SharedQTable slows down fast
+MAX_LOAD = 0.7
+
+
+def save_table(path, keys, values):
+    """
+    Write the states packed as `keys`, a uint64 array, and their rows
+    of Q-values `values` to `path` in the format read by `MmapQTable`.
+    """
+    order = np.argsort(keys)
+    with open(path, "wb") as f:
+        f.write(FILE_HEADER.pack(FILE_MAGIC, len(keys)))
+        f.write(keys[order].tobytes())
+        f.write(values[order].astype(np.float32).tobytes())
+
+
+class LeastVisited():
+
+    def __init__(self, capacity):
+        """
+        Evict the rows of the states inserted the fewest times. Counts
+        are halved after every eviction so that states visited often
+        long ago can make way for states visited often lately.
+        """
+        self.visits = np.zeros(capacity, dtype=np.uint32)
+
+    def touch(self, r):
+        self.visits[r] += 1
+
+    def evict(self, n):
+        rows = np.argpartition(self.visits, n - 1)[:n]
+        self.visits >>= 1
+        self.visits[rows] = 0
+        return rows
+
+
+class LRU():
+
+    def __init__(self, capacity):
+        """
+        Evict the rows of the states inserted least recently.
+        """
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.clock = 0
+
+    def touch(self, r):
+        self.clock += 1
+        self.last_used[r] = self.clock
+
+    def evict(self, n):
+        return np.argpartition(self.last_used, n - 1)[:n]
+
+
+class Clock():
+
+    def __init__(self, capacity):
+        """
+        Evict rows in the order of a hand going round all of them,
+        skipping once the rows of states inserted since it last passed:
+        close to LRU at the cost of one bit per row.
+        """
+        self.referenced = np.zeros(capacity, dtype=bool)
+        self.hand = 0
+
+    def touch(self, r):
+        self.referenced[r] = True
+
+    def evict(self, n):
+        rows = []
+        # once the hand has gone round, rows picked on the way are
+        # unreferenced too and must not be picked again
+        picked = np.zeros(len(self.referenced), dtype=bool)
+        while len(rows) < n:
+            if self.referenced[self.hand]:
+                self.referenced[self.hand] = False
+            elif not picked[self.hand]:
+                picked[self.hand] = True
+                rows.append(self.hand)
+            self.hand = (self.hand + 1) % len(self.referenced)
+        return np.array(rows)
+
+
+EVICTION_POLICIES = {"least-visited": LeastVisited, "lru": LRU, "clock": Clock}
+
+
+class QTable():
+
+    def __init__(self, capacity=1024, max_states=None, eviction="least-visited"):
+        """
+        Initialize an empty table of Q-values.
+
+        Every state gets one row of `values`, a float32 matrix with one
+        column per action, and `index` maps the state's `board_key` to
+        its row. Actions that were never updated read as 0.
+
+        While `touched` is a dict, it counts the updates of every action
+        of every state, see `start_delta`.
+
+        Given `max_states`, the table never holds more states than that.
+        Once it is full, inserting a new state first evicts a sixteenth
+        of the states, picked by `eviction`: the name of one of
+        `EVICTION_POLICIES` or a class like them, built with the number
+        of rows, told of every row inserted by `touch(r)` and asked for
+        `n` rows to evict by `evict(n)`. `evicted` counts the states
+        evicted so far and `evictions` the times it happened.
+
+        `added` counts the states added so far, evicted or not.
+        """
+        self.index = dict()
+        self.touched = None
+        self.added = 0
+
+        self.max_states = max_states
+        self.eviction = eviction
+        self.evicted = 0
+        self.evictions = 0
+        self.free = []
+        if max_states is None:
+            self.policy = None
+        else:
+            capacity = min(capacity, max_states)
+            policy = EVICTION_POLICIES.get(eviction, eviction)
+            self.policy = policy(max_states)
+            self.row_keys = np.zeros(max_states, dtype=np.uint64)
+
+        self.values = np.zeros((capacity, WIDTH), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def find(self, key):
+        """
+        Return the row number of the state packed as `key`,
+        or None if the state has no Q-values yet.
+        """
+        return self.index.get(key)
+
+    def row(self, key):
+        """
+        Return the Q-values of every action in the state packed as `key`
+        as a list, or None if the state has no Q-values yet.
+        """
+        r = self.index.get(key)
+        return None if r is None else self.values[r].tolist()
+
+    def insert(self, key, action=None):
+        """
+        Return the row number of the state packed as `key`,
+        adding a row of zeros for it if needed.
+        Rows are inserted to be updated, so this counts as a visit of
+        `action`, or of every action if None.
+        """
+        if self.touched is not None:
+            counts = self.touched.get(key)
+            if counts is None:
+                counts = self.touched[key] = [0] * WIDTH
+            if action is None:
+                self.touched[key] = [count + 1 for count in counts]
+            else:
+                counts[action] += 1
+
+        r = self.index.get(key)
+        if r is None:
+            if len(self.index) == self.max_states:
+                self.evict()
+            if self.free:
+                r = self.free.pop()
+            else:
+                r = len(self.index)
+                if r == len(self.values):
+                    size = 2 * len(self.values)
+                    if self.max_states is not None:
+                        size = min(size, self.max_states)
+                    grown = np.zeros((size, WIDTH), dtype=np.float32)
+                    grown[:r] = self.values
+                    self.values = grown
+            self.index[key] = r
+            self.added += 1
+            if self.policy is not None:
+                self.row_keys[r] = key
+
+        if self.policy is not None:
+            self.policy.touch(r)
+        return r
+
+    def evict(self):
+        """
+        Remove a sixteenth of the states of a full table, as picked by
+        its eviction policy, and keep their rows for new states.
+        """
+        rows = self.policy.evict(max(1, self.max_states // 16))
+        for key, r in zip(self.row_keys[rows].tolist(), rows.tolist()):
+            del self.index[key]
+            if self.touched is not None:
+                self.touched.pop(key, None)
+        self.values[rows] = 0
+        self.free.extend(rows.tolist())
+        self.evicted += len(rows)
+        self.evictions += 1
+
+    def update(self, other):
+        """
+        Copy every row of the QTable `other` into this one,
+        replacing the rows of states that are in both.
+        """
+        for key, r in other.index.items():
+            # insert first, it may replace `self.values` with a larger matrix
+            row = self.insert(key)
+            self.values[row] = other.values[r]
+
+    def start_delta(self):
+        """
+        Start recording which actions of which states get updated and
+        how many times.
+        """
+        self.touched = dict()
+
+    def take_delta(self):
+        """
+        Return `(keys, rows, visits)` for the states updated since
+        `start_delta` or the last `take_delta`: their keys, their rows
+        of Q-values and the number of updates of every action, as an
+        `(n, 7)` matrix. Recording starts over.
+        """
+        touched, self.touched = self.touched, dict()
+
+        keys = np.fromiter(touched.keys(), dtype=np.uint64, count=len(touched))
+        visits = np.array(list(touched.values()), dtype=np.uint32).reshape(len(touched), WIDTH)
+        rows = self.values[[self.index[key] for key in touched]].reshape(len(touched), WIDTH)
+        return keys, rows, visits
+
+    def set_rows(self, keys, rows):
+        """
+        Overwrite the rows of the states packed as `keys` with `rows`.
+        """
+        for key, values in zip(keys.tolist(), rows):
+            r = self.insert(key)
+            self.values[r] = values
+
+    def merge_deltas(self, deltas):
+        """
+        Merge `deltas` taken by `take_delta` from copies of this table.
+
+        Every Q-value updated in several deltas gets the average of their
+        values weighted by how many times each copy updated that action.
+        Actions no copy updated keep the Q-values of this table. Return
+        the merged `(keys, rows)` so they can be passed on to `set_rows`.
+        """
+        keys = np.concatenate([delta[0] for delta in deltas])
+        rows = np.concatenate([delta[1] for delta in deltas])
+        visits = np.concatenate([delta[2] for delta in deltas]).astype(np.float32)
+
+        keys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        totals = np.zeros((len(keys), WIDTH), dtype=np.float32)
+        weights = np.zeros((len(keys), WIDTH), dtype=np.float32)
+        np.add.at(totals, inverse, rows * visits)
+        np.add.at(weights, inverse, visits)
+
+        merged = np.zeros((len(keys), WIDTH), dtype=np.float32)
+        for i, key in enumerate(keys.tolist()):
+            r = self.index.get(key)
+            if r is not None:
+                merged[i] = self.values[r]
+        updated = weights > 0
+        merged[updated] = totals[updated] / weights[updated]
+        self.set_rows(keys, merged)
+        return keys, merged
+
+    def save(self, path):
+        """
+        Write the table to `path` in the format read by `MmapQTable`.
+        """
+        keys = np.fromiter(self.index.keys(), dtype=np.uint64, count=len(self.index))
+        rows = np.fromiter(self.index.values(), dtype=np.int64, count=len(self.index))
+        save_table(path, keys, self.values[rows])
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a table written by `QTable.save` into memory so it can be updated.
+        """
+        saved = MmapQTable(path)
+        table = cls(capacity=max(1024, 2 * len(saved)))
+        table.index = dict(zip(saved.keys.tolist(), range(len(saved))))
+        table.values[:len(saved)] = saved.values
+        return table
+
+    def __getstate__(self):
+        # only pickle the rows in use, in the order of `index`
+        rows = np.fromiter(self.index.values(), dtype=np.int64, count=len(self.index))
+        return {
+            "keys": list(self.index), "values": self.values[rows],
+            "max_states": self.max_states, "eviction": self.eviction,
+        }
+
+    def __setstate__(self, state):
+        # the eviction policy starts over, as if every state was inserted once
+        n = len(state["keys"])
+        self.__init__(max(1024, 2 * n), state["max_states"], state["eviction"])
+        if self.policy is None:
+            self.index = dict(zip(state["keys"], range(n)))
+        else:
+            for key in state["keys"]:
+                self.insert(key)
+        self.values[:n] = state["values"]
+
+
+class MmapQTable():
+
+    def __init__(self, path):
+        """
+        Open the table saved by `QTable.save` at `path` read-only.
+
+        The file is memory-mapped rather than read, so opening takes
+        the same time whatever its size, lookups binary search the
+        sorted keys in place, and every process opening the same file
+        shares one copy of it in the OS page cache.
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, n = FILE_HEADER.unpack_from(self.mmap)
+        if magic != FILE_MAGIC:
+            raise ValueError(f"{path} is not a saved QTable")
+
+        self.keys = np.frombuffer(self.mmap, dtype=np.uint64, count=n, offset=FILE_HEADER.size)
+        self.values = np.frombuffer(
+            self.mmap, dtype=np.float32, count=n * WIDTH, offset=FILE_HEADER.size + 8 * n
+        ).reshape(n, WIDTH)
+
+        # plain memoryviews of the same bytes are cheaper to probe one by one
+        self.key_view = memoryview(self.mmap)[FILE_HEADER.size:FILE_HEADER.size + 8 * n].cast("Q")
+        self.value_view = memoryview(self.mmap)[FILE_HEADER.size + 8 * n:].cast("f")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, key):
+        """
+        Return the row number of the state packed as `key`,
+        or None if the state is not in the table.
+        """
+        r = bisect.bisect_left(self.key_view, key)
+        return r if r < len(self.key_view) and self.key_view[r] == key else None
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def row(self, key):
+        """
+        Return the Q-values of every action in the state packed as `key`
+        as a list, or None if the state is not in the table.
+        """
+        r = self.find(key)
+        return None if r is None else self.value_view[r * WIDTH:(r + 1) * WIDTH].tolist()
+
+    def insert(self, key, action=None):
+        raise TypeError(f"{self.path} is opened read-only, use QTable.load to update it")
+
+    def __getstate__(self):
+        # reopen the same file instead of copying the table
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+
+class SharedQTable():
+
+    def __init__(self, capacity=1 << 20, n_locks=64):
+        """
+        Create a table of Q-values in shared memory that every process
+        it is passed to reads and updates in place.
+
+        The table is open addressing over flat arrays: `keys` holds the
+        `board_key` of the state in every slot, 0 for a free slot, and
+        `values` the slot's row of Q-values. `capacity` is rounded up to
+        a power of two and is fixed, so the table must not fill up, and
+        should stay below `MAX_LOAD` to keep probing fast.
+
+        Claiming a free slot takes one of `n_locks` locks, picked by slot.
+        `added` counts the states this process added, not the others.
+        Updates to Q-values take no lock at all: two processes updating
+        the same Q-value at once can lose one of the updates, which costs
+        far less than locking every update.
+        """
+        capacity = 1 << max(0, capacity - 1).bit_length()
+        self.shm = shared_memory.SharedMemory(create=True, size=capacity * (8 + 4 * WIDTH))
+        self.locks = [multiprocessing.Lock() for _ in range(n_locks)]
+        self.attach(capacity)
+
+    def attach(self, capacity):
+        self.capacity = capacity
+        self.added = 0
+        self.keys = np.ndarray((capacity,), dtype=np.uint64, buffer=self.shm.buf)
+        self.values = np.ndarray((capacity, WIDTH), dtype=np.float32, buffer=self.shm.buf, offset=8 * capacity)
+
+        # plain memoryviews of the same bytes are cheaper to probe one by one
+        self.key_view = self.shm.buf[:8 * capacity].cast("Q")
+        self.value_view = self.shm.buf[8 * capacity:].cast("f")
+
+    @classmethod
+    def from_table(cls, table, capacity=1 << 20, n_locks=64):
+        """
+        Copy the QTable `table` into a new SharedQTable with room for
+        at least `capacity` states and twice the states of `table`.
+        """
+        shared = cls(capacity=max(capacity, 2 * len(table)), n_locks=n_locks)
+        keys = np.fromiter(table.index.keys(), dtype=np.uint64, count=len(table))
+        rows = np.fromiter(table.index.values(), dtype=np.int64, count=len(table))
+        shared.set_rows(keys, table.values[rows])
+        return shared
+
+    def __len__(self):
+        return int(np.count_nonzero(self.keys))
+
+    def load_factor(self):
+        return len(self) / self.capacity
+
+    def slot(self, key):
+        """
+        Return the slot holding the state packed as `key`, or the free
+        slot where it would go.
+        """
+        mask = self.capacity - 1
+        # Fibonacci hashing spreads the structured keys over all slots
+        s = (key * 0x9E3779B97F4A7C15 >> 16) & mask
+        for _ in range(self.capacity):
+            k = self.key_view[s]
+            if k == key or k == 0:
+                return s
+            s = (s + 1) & mask
+        raise MemoryError(f"SharedQTable is full ({self.capacity} states)")
+
+    def find(self, key):
+        """
+        Return the slot number of the state packed as `key`,
+        or None if the state has no Q-values yet.
+        """
+        s = self.slot(key)
+        return s if self.key_view[s] == key else None
+
+    def __contains__(self, key):
+        return self.key_view[self.slot(key)] == key
+
+    def row(self, key):
+        """
+        Return the Q-values of every action in the state packed as `key`
+        as a list, or None if the state has no Q-values yet.
+        """
+        s = self.slot(key)
+        if self.key_view[s] != key:
+            return None
+        return self.value_view[s * WIDTH:(s + 1) * WIDTH].tolist()
+
+    def insert(self, key, action=None):
+        """
+        Return the slot number of the state packed as `key`,
+        claiming a free slot for it if needed. `action` is taken
+        like `QTable.insert` takes it, and not used.
+        """
+        while True:
+            s = self.slot(key)
+            if self.key_view[s] == key:
+                return s
+            with self.locks[s % len(self.locks)]:
+                # another process may have claimed the slot meanwhile
+                if self.key_view[s] == 0:
+                    self.key_view[s] = key
+                    self.added += 1
+                    return s
+
+    def set_rows(self, keys, rows):
+        """
+        Overwrite the rows of the states packed as `keys` with `rows`.
+        """
+        for key, values in zip(keys.tolist(), rows):
+            self.values[self.insert(key)] = values
+
+    def save(self, path):
+        """
+        Write the table to `path` in the format read by `MmapQTable`.
+        """
+        used = self.keys != 0
+        save_table(path, self.keys[used], self.values[used])
+
+    def close(self):
+        """
+        Detach this process from the table. The process that created
+        the table must also `unlink` it once no process needs it.
+        """
+        self.key_view.release()
+        self.value_view.release()
+        del self.keys, self.values
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+    def __getstate__(self):
+        # processes share the memory by name instead of copying it
+        return {"name": self.shm.name, "capacity": self.capacity, "locks": self.locks}
+
+    def __setstate__(self, state):
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self.locks = state["locks"]
+        self.attach(state["capacity"])
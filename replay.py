@@ -0,0 +1,96 @@
+import numpy as np
+
+from q_connect4 import WIDTH, HEIGHT, board_key, mirror_key
+from q_connect4_agent import canonical_action
+
+# the bit of a `board_key` that is set when a column is full, as the
+# marker above its chips then sits at the top of the column
+FULL_BITS = np.array([col * (HEIGHT + 1) + HEIGHT for col in range(WIDTH)], dtype=np.uint64)
+# the columns with no Q-values of their own in a state that is its own
+# mirror image, see `canonical_action`
+RIGHT_HALF = np.arange(WIDTH) > WIDTH // 2
+
+
+class ReplayBuffer():
+
+    def __init__(self, capacity, seed=None):
+        """
+        Initialize a ring buffer of at most `capacity` transitions, kept in
+        preallocated arrays: the `canonical_action` of the state and the
+        action taken in it, the reward, the `canonical_key` of the state
+        it led to, whether that state is its own mirror image, and whether
+        the game ended there. Once full, new transitions overwrite the
+        oldest ones.
+        """
+        self.capacity = capacity
+        self.keys = np.zeros(capacity, dtype=np.uint64)
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_keys = np.zeros(capacity, dtype=np.uint64)
+        self.next_symmetric = np.zeros(capacity, dtype=bool)
+        self.done = np.zeros(capacity, dtype=bool)
+        self.position = 0
+        self.size = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, old_state, action, new_state, reward, done=False):
+        """
+        Add the transition of `QConnect4Agent.update(old_state, action,
+        new_state, reward)`, where `done` tells if `new_state` ends the game.
+        """
+        key, action = canonical_action(board_key(old_state), action)
+        next_key = board_key(new_state)
+        next_mirrored = mirror_key(next_key)
+        i = self.position
+        self.keys[i] = key
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_keys[i] = min(next_key, next_mirrored)
+        self.next_symmetric[i] = next_key == next_mirrored
+        self.done[i] = done
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """
+        Return the indices of `batch_size` transitions drawn uniformly,
+        with replacement.
+        """
+        return self.rng.integers(0, self.size, size=batch_size)
+
+
+def learn(q, buffer, batch_size, alpha):
+    """
+    Apply the Q-learning update of `QConnect4Agent.update` with learning
+    rate `alpha` to the table `q` for `batch_size` transitions sampled from
+    the ReplayBuffer `buffer`. The targets of the whole batch are worked
+    out at once from the Q-values from before the batch.
+    """
+    batch = buffer.sample(batch_size)
+    keys = buffer.keys[batch].tolist()
+    next_keys = buffer.next_keys[batch]
+    actions = buffer.actions[batch]
+
+    # the best Q-value of the next state's available actions, 0 where
+    # the game is over or the next state has no Q-values
+    rows = np.array([-1 if r is None else r for r in map(q.find, next_keys.tolist())])
+    known = (rows >= 0) & ~buffer.done[batch]
+    future = np.zeros(batch_size, dtype=np.float32)
+    if known.any():
+        full = ((next_keys[known, None] >> FULL_BITS) & np.uint64(1)) == 1
+        # the right half of a symmetric state has the left half's Q-values
+        full |= buffer.next_symmetric[batch][known, None] & RIGHT_HALF
+        best = np.where(full, -np.inf, q.values[rows[known]]).max(axis=1)
+        # a state with every column full has no actions to take
+        future[known] = np.where(np.isinf(best), 0, best)
+
+    # Each row is written right after its insert: in a table with
+    # `max_states`, a later insert may evict it and hand it to another state.
+    targets = (buffer.rewards[batch] + future).tolist()
+    for key, action, target in zip(keys, actions.tolist(), targets):
+        r = q.insert(key, action)
+        old = q.values[r, action]
+        q.values[r, action] = old + alpha * (target - old)
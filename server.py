@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from minimax import Minimax
+from opening_book import OpeningBook
+from play import agent_move
+from q_connect4 import Connect4
+from q_connect4_agent import QConnect4Agent
+from q_table import MmapQTable
+
+HELP = "commands: NEW [FIRST|SECOND], MOVE <1-7>, BOARD, QUIT"
+
+# the Minimax of an executor process, built once by `init_helper`
+helper = None
+
+
+def init_helper(options):
+    global helper
+    helper = Minimax(**options)
+
+
+def helper_move(board, time_budget_ms):
+    return helper.get_move(board, time_budget_ms=time_budget_ms)
+
+
+def board_line(board):
+    """
+    Return `board` as 42 characters, top row first: '.' for an empty
+    square, '0' and '1' for the chips of the first and second player.
+    """
+    return ''.join('.' if sq == ' ' else str(sq) for sq in board)
+
+
+class GameServer():
+
+    def __init__(self, q_agent, executor=None, helper_time_ms=2000):
+        """
+        Initialize a server of games against `q_agent`, which every
+        session shares and only reads.
+
+        Given `executor`, a ProcessPoolExecutor set up by `init_helper`,
+        the agent's moves are checked by a Minimax helper search in it,
+        as by `play.play` with `helper`, taking at most about
+        `helper_time_ms`, so searches never hold up the other sessions.
+        """
+        self.q_agent = q_agent
+        self.executor = executor
+        self.helper_time_ms = helper_time_ms
+        self.sessions = 0
+
+    async def agent_turn(self, connect4, writer):
+        """
+        Play the agent's move in `connect4` and report it.
+        """
+        found = None
+        if self.executor is not None:
+            loop = asyncio.get_running_loop()
+            found = await loop.run_in_executor(
+                self.executor, helper_move, connect4.board[:], self.helper_time_ms
+            )
+        column = agent_move(self.q_agent, connect4.board, found)
+        connect4.move(column)
+        writer.write(f"AGENT {column + 1}\n".encode())
+
+    def report_result(self, connect4, human, writer):
+        if connect4.result == 2:
+            outcome = "TIE"
+        elif connect4.result == human:
+            outcome = "WIN"
+        else:
+            outcome = "LOSS"
+        writer.write(f"RESULT {outcome}\n".encode())
+
+    async def session(self, reader, writer):
+        """
+        Serve one connection, a line per command and one or more lines
+        per reply:
+            NEW [FIRST|SECOND]  start a game, moving first by default
+                                -> OK, then AGENT <column> if it moves first
+            MOVE <column>       play in column 1 to 7
+                                -> OK, then AGENT <column> and
+                                   RESULT WIN|LOSS|TIE when the game ends
+            BOARD               -> BOARD <42 squares>, see `board_line`
+            QUIT                -> BYE, and the connection is closed
+        Anything else gets ERR and a reason.
+        """
+        self.sessions += 1
+        connect4 = None
+        human = 0
+        writer.write(f"HELLO {HELP}\n".encode())
+
+        try:
+            while True:
+                await writer.drain()
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # longer than the reader's limit
+                    writer.write(b"ERR line too long\n")
+                    break
+                if not line:
+                    break
+                command, *args = line.decode(errors="replace").split() or [""]
+                command = command.upper()
+
+                if command == "QUIT":
+                    writer.write(b"BYE\n")
+                    break
+
+                elif command == "NEW":
+                    human = 1 if args and args[0].upper() == "SECOND" else 0
+                    connect4 = Connect4()
+                    writer.write(b"OK\n")
+                    if human == 1:
+                        await self.agent_turn(connect4, writer)
+
+                elif command == "BOARD":
+                    if connect4 is None:
+                        writer.write(b"ERR no game, send NEW\n")
+                    else:
+                        writer.write(f"BOARD {board_line(connect4.board)}\n".encode())
+
+                elif command == "MOVE":
+                    if connect4 is None or connect4.result is not None:
+                        writer.write(b"ERR no game, send NEW\n")
+                        continue
+                    column = int(args[0]) - 1 if args and args[0].isdigit() else -1
+                    if column not in connect4.available_actions(connect4.board):
+                        writer.write(b"ERR column full or invalid\n")
+                        continue
+
+                    connect4.move(column)
+                    writer.write(b"OK\n")
+                    if connect4.result is None:
+                        await self.agent_turn(connect4, writer)
+                    if connect4.result is not None:
+                        self.report_result(connect4, human, writer)
+
+                else:
+                    writer.write(f"ERR {HELP}\n".encode())
+
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions -= 1
+            writer.close()
+
+
+async def serve(q_agent, host="127.0.0.1", port=4444, helper=False, helper_depth=20,
+                helper_time_ms=2000, processes=None):
+    """
+    Serve games against `q_agent` on `host`:`port` until cancelled.
+    With `helper`, Minimax helper searches run in `processes` processes.
+    """
+    executor = None
+    if helper:
+        options = {"max_depth": helper_depth, "book": getattr(q_agent, "book", None)}
+        executor = ProcessPoolExecutor(processes, initializer=init_helper, initargs=(options,))
+
+    game_server = GameServer(q_agent, executor, helper_time_ms)
+    # a small line limit keeps the buffer of every idle session small
+    server = await asyncio.start_server(game_server.session, host, port, limit=1024)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve Connect 4 games against the trained agent.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4444)
+    parser.add_argument("--helper", action="store_true", help="check the agent's moves with Minimax")
+    parser.add_argument("--processes", type=int, help="processes for helper searches, one per cpu by default")
+    args = parser.parse_args()
+
+    # one read-only agent for every session, the table memory-mapped
+    book = OpeningBook('opening_book.c4b') if os.path.exists('opening_book.c4b') else None
+    q_agent = QConnect4Agent(q=MmapQTable('q_agent_q.c4q'), book=book)
+    asyncio.run(serve(q_agent, args.host, args.port, args.helper, processes=args.processes))
@@ -0,0 +1,255 @@
+import time
+
+from minimax import CENTER_FIRST, SearchTimeout
+from q_connect4 import WIDTH, HEIGHT, BOTTOM_MASK, SQUARE_BITS
+
+# Positions are bitboards laid out as in `q_connect4`: `current` has
+# the chips of the player to move, `mask` the chips of both players.
+BOARD_MASK = BOTTOM_MASK * ((1 << HEIGHT) - 1)
+SQUARES = WIDTH * HEIGHT
+
+# the best and worst score of a position that does not end the game
+# within two moves, see `Solver.negamax`
+MIN_SCORE = -SQUARES // 2 + 3
+MAX_SCORE = (SQUARES + 1) // 2 - 3
+
+
+def column_mask(col):
+    return ((1 << HEIGHT) - 1) << col * (HEIGHT + 1)
+
+
+def winning_squares(current, mask):
+    """
+    Return the empty squares of `mask` that would give the chips
+    `current` four in a row.
+    """
+    # vertical
+    r = (current << 1) & (current << 2) & (current << 3)
+
+    # horizontal and both diagonals
+    for shift in (HEIGHT + 1, HEIGHT, HEIGHT + 2):
+        pairs = (current << shift) & (current << 2 * shift)
+        r |= pairs & (current << 3 * shift)
+        r |= pairs & (current >> shift)
+        pairs = (current >> shift) & (current >> 2 * shift)
+        r |= pairs & (current << shift)
+        r |= pairs & (current >> 3 * shift)
+
+    return r & (BOARD_MASK ^ mask)
+
+
+def playable(mask):
+    """
+    Return the squares where a chip can be played next, one per column.
+    """
+    return (mask + BOTTOM_MASK) & BOARD_MASK
+
+
+def position_from_state(state):
+    """
+    Return `(current, mask, moves)` for the 42-square `state` list,
+    with 0 for the chips of the first player and 1 for the second.
+    """
+    chips = [0, 0]
+    for bit, sq in zip(SQUARE_BITS, state):
+        if sq != ' ':
+            chips[sq] |= bit
+    moves = len(state) - state.count(' ')
+    return chips[moves % 2], chips[0] | chips[1], moves
+
+
+def position_from_moves(sequence):
+    """
+    Return `(current, mask, moves)` after playing `sequence`, a string
+    of columns numbered from 1 as in the usual Connect 4 test sets,
+    or None if a move is invalid or ends the game.
+    """
+    current, mask, moves = 0, 0, 0
+    for c in sequence:
+        col = int(c) - 1
+        if not 0 <= col < WIDTH:
+            return None
+        move = playable(mask) & column_mask(col)
+        if not move or winning_squares(current, mask) & move:
+            return None
+        current, mask, moves = current ^ mask, mask | move, moves + 1
+    return current, mask, moves
+
+
+class Solver():
+
+    def __init__(self, max_entries=1 << 22):
+        """
+        Initialize a Connect 4 solver: a negamax search to the end of
+        the game on bitboards, with null windows, a transposition table
+        of at most `max_entries` positions, and moves that create the
+        most threats of four in a row searched first.
+
+        Scores are as in Pascal Pons's solver: positive when the player
+        to move wins, more so the sooner it wins, 0 for a draw and
+        negative when it loses.
+        """
+        self.max_entries = max_entries
+        self.tt = dict()
+        self.nodes = 0
+        self.deadline = None
+
+    def non_losing_moves(self, current, mask):
+        """
+        Return the playable squares that do not hand the opponent an
+        immediate win, which is none at all if the opponent has two
+        threats or a move must block a threat under another one.
+        """
+        moves = playable(mask)
+        threats = winning_squares(current ^ mask, mask)
+        forced = moves & threats
+        if forced:
+            if forced & (forced - 1):
+                return 0
+            moves = forced
+        # never play just below an opponent's threat
+        return moves & ~(threats >> 1)
+
+    def negamax(self, current, mask, moves, alpha, beta):
+        """
+        Return the score of the position `(current, mask, moves)`, where
+        the player to move cannot win at once, if it lies within
+        `(alpha, beta)`, or else a bound on it past that window.
+        """
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & 1023 and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+        candidates = self.non_losing_moves(current, mask)
+        if not candidates:
+            return -((SQUARES - moves) // 2)
+        if moves >= SQUARES - 2:
+            return 0
+
+        # the opponent cannot win on its next move
+        lowest = -((SQUARES - 2 - moves) // 2)
+        if alpha < lowest:
+            alpha = lowest
+            if alpha >= beta:
+                return alpha
+        # the player to move cannot win on this move
+        highest = (SQUARES - 1 - moves) // 2
+        if beta > highest:
+            beta = highest
+            if alpha >= beta:
+                return beta
+
+        key = current + mask
+        entry = self.tt.get(key)
+        if entry is not None:
+            if entry > MAX_SCORE - MIN_SCORE + 1:
+                lowest = entry + 2 * MIN_SCORE - MAX_SCORE - 2
+                if alpha < lowest:
+                    alpha = lowest
+                    if alpha >= beta:
+                        return alpha
+            else:
+                highest = entry + MIN_SCORE - 1
+                if beta > highest:
+                    beta = highest
+                    if alpha >= beta:
+                        return beta
+
+        # moves making the most threats first, then center columns first
+        ordered = []
+        for col in CENTER_FIRST:
+            move = candidates & column_mask(col)
+            if move:
+                threats = bin(winning_squares(current | move, mask)).count('1')
+                ordered.append((-threats, len(ordered), move))
+        ordered.sort()
+
+        for threats, i, move in ordered:
+            score = -self.negamax(current ^ mask, mask | move, moves + 1, -beta, -alpha)
+            if score >= beta:
+                self.save(key, score + MAX_SCORE - 2 * MIN_SCORE + 2)
+                return score
+            if score > alpha:
+                alpha = score
+
+        self.save(key, alpha - MIN_SCORE + 1)
+        return alpha
+
+    def save(self, key, entry):
+        """
+        Keep `entry`, a lower bound above `MAX_SCORE - MIN_SCORE + 1` or
+        an upper bound at or below it, for the position packed as `key`.
+        """
+        if len(self.tt) >= self.max_entries:
+            self.tt.clear()
+        self.tt[key] = entry
+
+    def solve(self, current, mask, moves, weak=False):
+        """
+        Return the score of the position `(current, mask, moves)`.
+        A `weak` solve only tells a win (1) from a draw (0) or a loss (-1).
+        """
+        if winning_squares(current, mask) & playable(mask):
+            return 1 if weak else (SQUARES + 1 - moves) // 2
+
+        lowest = -((SQUARES - moves) // 2)
+        highest = (SQUARES + 1 - moves) // 2
+        if weak:
+            lowest, highest = -1, 1
+
+        # narrow down the score with null windows, trying scores
+        # closer to 0 first since they are cheaper to refute
+        while lowest < highest:
+            med = lowest + (highest - lowest) // 2
+            if med <= 0 and int(lowest / 2) < med:
+                med = int(lowest / 2)
+            elif med >= 0 and int(highest / 2) > med:
+                med = int(highest / 2)
+            score = self.negamax(current, mask, moves, med, med + 1)
+            if score <= med:
+                highest = score
+            else:
+                lowest = score
+        return max(-1, min(1, lowest)) if weak else lowest
+
+    def get_move(self, state, time_budget_ms=None):
+        """
+        Return `(best_action, values)` for `state` like `Minimax.get_move`,
+        with the value of every available action 1000 if the first
+        player wins with perfect play, -1000 if the second player does,
+        and 0 for a draw.
+
+        Given `time_budget_ms`, actions left unsolved once that many
+        milliseconds have passed are valued 0 as well.
+        """
+        current, mask, moves = position_from_state(state)
+        sign = 1 if moves % 2 == 0 else -1
+
+        self.nodes = 0
+        if time_budget_ms is not None:
+            self.deadline = time.perf_counter() + time_budget_ms / 1000
+
+        actions = [col for col in range(WIDTH) if playable(mask) & column_mask(col)]
+        values = []
+        try:
+            for action in actions:
+                move = playable(mask) & column_mask(action)
+                if winning_squares(current, mask) & move:
+                    score = 1
+                elif moves + 1 == SQUARES:
+                    score = 0
+                else:
+                    score = -self.solve(current ^ mask, mask | move, moves + 1, weak=True)
+                if score > 0:
+                    values.append(1000 * sign)
+                elif score < 0:
+                    values.append(-1000 * sign)
+                else:
+                    values.append(0)
+        except SearchTimeout:
+            values += [0] * (len(actions) - len(values))
+        finally:
+            self.deadline = None
+
+        best = max(values) if sign == 1 else min(values)
+        return actions[values.index(best)], values
@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from q_connect4 import board_key
+from q_connect4_agent import QConnect4Agent, migrate_q
+from q_table import EVICTION_POLICIES, QTable
+from replay import ReplayBuffer
+from train import train, train_replay
+
+
+def check_consistent(q):
+    rows = list(q.index.values())
+    assert len(set(rows)) == len(rows)
+    assert len(q) <= q.max_states
+    assert all(q.row_keys[r] == key for key, r in q.index.items())
+    assert set(rows).isdisjoint(q.free)
+    assert len(set(q.free)) == len(q.free)
+    assert sorted(rows + q.free) == list(range(len(rows) + len(q.free)))
+
+
+@pytest.mark.parametrize("eviction", list(EVICTION_POLICIES))
+def test_capped_table_stays_consistent(eviction):
+    q = QTable(max_states=100, eviction=eviction)
+    rng = random.Random(0)
+    for _ in range(5000):
+        # a few hot states among many cold ones
+        key = rng.randrange(1, 20) if rng.random() < 0.3 else rng.randrange(1, 5000)
+        q.values[q.insert(key), 0] += 1
+        check_consistent(q)
+    assert q.evictions > 0
+
+
+@pytest.mark.parametrize("eviction", list(EVICTION_POLICIES))
+def test_capped_table_trains(eviction):
+    random.seed(1)
+    q_agent = QConnect4Agent(epsilon=.5, q=QTable(max_states=500, eviction=eviction))
+    reports = []
+    train(q_agent, 300, metrics=reports.append, report_every=300)
+    check_consistent(q_agent.q)
+    assert q_agent.q.evicted > 0
+    # evicted states were new states too
+    assert reports[-1]["new_states"] == len(q_agent.q) + q_agent.q.evicted
+
+
+def test_replay_learns_into_capped_table():
+    random.seed(0)
+    q_agent = QConnect4Agent(epsilon=.5, q=QTable(max_states=300))
+    train_replay(q_agent, 300, batch_size=64)
+    check_consistent(q_agent.q)
+    assert q_agent.q.evicted > 0
+
+
+def test_self_mirror_state_shares_mirrored_actions():
+    empty = [' '] * 42
+    q_agent = QConnect4Agent()
+    q_agent.update(empty, 1, empty, 1)
+    q_agent.update(empty, 5, empty, 1)
+    row = q_agent.get_q_values(empty)
+    assert row[1] == row[5] == 1.0
+    assert q_agent.q.row(board_key(empty))[5] == 0
+
+    q = migrate_q({board_key(empty) << 3 | 6: 1.0})
+    assert q.row(board_key(empty))[0] == 1.0
+
+    buffer = ReplayBuffer(4)
+    buffer.add(empty, 4, empty, 0)
+    assert buffer.actions[0] == 2 and buffer.next_symmetric[0]
+
+
+def test_merge_weights_every_action_by_its_own_updates():
+    parent = QTable()
+    parent.values[parent.insert(1)] = [0, 0, 0, 0, 0, 0, 0.5]
+
+    deltas = []
+    for action, n_updates in ((3, 3), (5, 1)):
+        worker = QTable()
+        worker.update(parent)
+        worker.start_delta()
+        for _ in range(n_updates):
+            worker.values[worker.insert(1, action), action] = 1.0
+        deltas.append(worker.take_delta())
+
+    keys, rows = parent.merge_deltas(deltas)
+    assert rows.tolist() == [[0, 0, 0, 1.0, 0, 1.0, 0.5]]
+    assert parent.row(1) == [0, 0, 0, 1.0, 0, 1.0, 0.5]
@@ -1,12 +1,31 @@
+import time
+
 from q_connect4_agent import QConnect4Agent
 from q_connect4 import Connect4
 from minimax import Minimax
+from replay import ReplayBuffer, learn
+
+def table_size(q_agent):
+    # agents without a Q-table, like NTupleConnect4Agent, have `q` None
+    return 0 if q_agent.q is None else len(q_agent.q)
+
 
-def train(q_agent, n):
+def train(q_agent, n, metrics=None, report_every=100):
     """
     Train QAgent `q_agent` by having it play `n` games against itself
+
+    If given, `metrics` is called with a dict of training metrics every
+    `report_every` games and after the last one: the games, moves and
+    Q-value updates so far and their rates since the last report, the
+    size of the Q-table, how many states this process added to it and
+    how many it evicted.
     """
-    
+
+    start = last_time = time.perf_counter()
+    # the states this process added, which a SharedQTable, unlike its size,
+    # does not mix with those of other processes
+    start_added = last_added = getattr(q_agent.q, "added", 0)
+    moves = updates = last_games = last_moves = 0
     # opponent = Minimax(max_depth=20)
     # print("--- train", n)
     for i in range(n):
@@ -35,6 +54,7 @@ def train(q_agent, n):
             prev_data[game.player]["action"] = action
 
             game.move(action)
+            moves += 1
             new_state = game.board[:]
 
             if game.result is not None:
@@ -42,8 +62,90 @@ def train(q_agent, n):
                 q_agent.update(state, action, new_state, -1)
                 # if the game is over the person whose turn it is must have won
                 q_agent.update(prev_data[game.player]["state"], prev_data[game.player]["action"], new_state, 1)
+                updates += 2
                 break
             elif prev_data[game.player]["state"] is not None:
                 q_agent.update(prev_data[game.player]["state"], prev_data[game.player]["action"], new_state, 0)
+                updates += 1
+
+        if metrics is not None and ((i + 1) % report_every == 0 or i + 1 == n):
+            now = time.perf_counter()
+            size = table_size(q_agent)
+            added = getattr(q_agent.q, "added", 0)
+            # every update of a state not in the table adds it, even if
+            # it is evicted again later
+            new_states = added - start_added
+            seconds = max(now - last_time, 1e-9)
+            metrics({
+                "event": "train",
+                "games": i + 1,
+                "moves": moves,
+                "updates": updates,
+                "seconds": now - start,
+                "games_per_sec": (i + 1 - last_games) / seconds,
+                "moves_per_sec": (moves - last_moves) / seconds,
+                "q_size": size,
+                "q_growth_per_sec": (added - last_added) / seconds,
+                "new_states": new_states,
+                # updates, not distinct states: a state updated twice counts twice
+                "revisit_updates": updates - new_states,
+                # only a QTable with `max_states` evicts states
+                "evicted": getattr(q_agent.q, "evicted", 0),
+            })
+            last_time, last_added = now, added
+            last_games, last_moves = i + 1, moves
+
+    return q_agent.q
+
+
+def train_replay(q_agent, n, buffer=None, batch_size=256, replay_ratio=1.0):
+    """
+    Train QAgent `q_agent` by having it play `n` games against itself
+    like `train`, but learning from a ReplayBuffer instead of updating
+    after every move.
+
+    Games only add their transitions to `buffer`, a new ReplayBuffer
+    of a million transitions if None. Batches of `batch_size` sampled
+    transitions are then learned, `replay_ratio` updates for every
+    transition added.
+    """
+
+    if buffer is None:
+        buffer = ReplayBuffer(1 << 20)
+    pending = 0
+
+    for i in range(n):
+        game = Connect4()
+
+        prev_data = {
+            0: {"state": None, "action": None},
+            1: {"state": None, "action": None}
+        }
+
+        while True:
+
+            state = game.board[:]
+
+            action = q_agent.choose_action(game.board)
+
+            prev_data[game.player]["state"] = state
+            prev_data[game.player]["action"] = action
+
+            game.move(action)
+            new_state = game.board[:]
+
+            if game.result is not None:
+                buffer.add(state, action, new_state, -1, done=True)
+                # if the game is over the person whose turn it is must have won
+                buffer.add(prev_data[game.player]["state"], prev_data[game.player]["action"], new_state, 1, done=True)
+                pending += 2 * replay_ratio
+                break
+            elif prev_data[game.player]["state"] is not None:
+                buffer.add(prev_data[game.player]["state"], prev_data[game.player]["action"], new_state, 0)
+                pending += replay_ratio
+
+        while pending >= batch_size:
+            learn(q_agent.q, buffer, batch_size, q_agent.alpha)
+            pending -= batch_size
 
-    return q_agent.q
\ No newline at end of file
+    return q_agent.q